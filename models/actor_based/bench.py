@@ -0,0 +1,388 @@
+"""
+Benchmarks how the models scale with the size of their populations.
+
+Each model is run at a few population sizes, one fresh process per size, and
+its ticks per second, peak memory, and time spent in each block and function
+per tick are written to a JSON file. Given the results of an earlier commit,
+it flags functions whose time grows faster with the population than it used
+to (e.g., a policy that went from linear to quadratic), and sizes that got
+slower overall.
+
+    python bench.py fs voting --out output/bench.json --baseline old.json
+"""
+from copy import deepcopy
+from datetime import datetime
+from functools import partial
+from itertools import islice
+from multiprocessing import get_context
+from random import uniform
+from time import perf_counter
+import argparse
+import importlib
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import numpy as np
+from engine import steps
+from profiler import instrument
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def populate_fs(model, params, n):
+    """
+    Get the fs model's initial state, with n users, and one provider for
+    every ten, drawn as the model draws new ones.
+    """
+    from actors.delta import apply
+    from actors.buyer import generate_users
+    from actors.provider import generate_providers
+
+    state = {**deepcopy(model.initial_state), "timestep": 0}
+
+    users = generate_users(
+        {**params, "new_user_interval": 1, "user_growth": "linear"}
+        | {"user_growth_rate": n - len(state["users"]), "max_users": n},
+        0,
+        [],
+        state,
+    )
+    apply(state["users"], users["users"])
+    state["user_head"] = users["user_head"]
+
+    for _ in range(max(n // 10 - len(state["providers"]), 0)):
+        providers = generate_providers(
+            {**params, "new_provider_interval": 1}, 0, [], state
+        )
+        apply(state["providers"], providers["providers"])
+        state["provider_head"] = providers["provider_head"]
+
+    return state
+
+
+def populate_voting(model, params, n):
+    """
+    Get the voting model's initial state, with n users, an idea for every
+    hundred, and a proposal for every ten, which stay open for the whole run.
+    """
+    from actors.user import User
+    from actors.idea import Idea
+    from actors.proposal import Proposal
+    from actors.open_proposals import OpenProposals
+    from actors.ledger import TokenLedger
+
+    state = deepcopy(model.initial_state)
+    (low_votes, high_votes) = params["proposal_required_votes_range"]
+
+    state["users"] = [
+        User(
+            params["user_starting_VIS"],
+            i,
+            min(1, max(0, np.random.normal(params["user_lie_mean"], 0.5))),
+            min(1, max(0, np.random.normal(params["user_sus_mean"], 0.5))),
+        )
+        for i in range(n)
+    ]
+    state["ideas"] = [
+        Idea(params["idea_token_volume"], i) for i in range(max(n // 100, 1))
+    ]
+    state["ledger"] = TokenLedger()
+    state["ledger"].mint(
+        [idea.idea_id for idea in state["ideas"]],
+        [idea.volume for idea in state["ideas"]],
+    )
+    state["proposals"] = {
+        i: Proposal(uniform(low_votes, high_votes), i % len(state["ideas"]), i, 10**9)
+        for i in range(n // 10)
+    }
+    state["open_proposals"] = OpenProposals(state["proposals"].values())
+
+    return state
+
+
+def count(key, state):
+    return len(state[key])
+
+
+def count_open(state):
+    return len(state["open_proposals"])
+
+
+# Per model: where it is, how to populate it, the params it is run with (on
+# top of those it has defaults for), the sizes of its state recorded every
+# tick, and the population sizes it is run at by default. Populations are kept
+# from growing on their own, so that they stay near the size being measured
+MODELS = {
+    "fs": {
+        "dir": "fs",
+        "populate": populate_fs,
+        "params": {
+            "new_user_interval": 10**9,
+            "new_provider_interval": 10**9,
+        },
+        "sizes": None,
+        "default_sizes": [100, 1000, 10000],
+    },
+    "voting": {
+        "dir": "voting",
+        "populate": populate_voting,
+        "params": {
+            "idea_token_volume": 100,
+            "ticks_per_idea": 10**9,
+            "ticks_per_user": 10**9,
+            "user_starting_VIS": 100,
+            "ticks_per_VIS_gift": 50,
+            "VIS_gift_amount": 50,
+            "user_chance_to_buy_token": 0.20,
+            "user_token_buy_precent_range": (0.05, 0.50),
+            "user_vote_chance": 0.5,
+            "user_vote_tokens_precent_range": (0.30, 1),
+            "proposal_required_votes_range": (5, 15),
+            "proposal_timeout_range": (10, 25),
+            "user_sus_mean": 0.8,
+            "user_lie_mean": 0.3,
+            "enforcer_information": 0.6,
+            "jury_information": 0.3,
+        },
+        "sizes": {
+            "n_users": partial(count, "users"),
+            "n_proposals": partial(count, "proposals"),
+            "n_open_proposals": count_open,
+            "n_voting_events": partial(count, "voting_events"),
+        },
+        "default_sizes": [30, 100, 300],
+    },
+}
+
+
+def bench(task):
+    """
+    Run a model at one population size, in a fresh process: warm it up for a
+    few ticks, then time a few more, block by block.
+    """
+    (name, n, ticks, warmup, seed, extra) = task
+    spec = MODELS[name]
+
+    sys.path.insert(0, os.path.join(HERE, spec["dir"]))
+    model = importlib.import_module("model")
+
+    random.seed(seed)
+    np.random.seed(seed)
+
+    initial_state = model.initial_state
+
+    if "rng" in initial_state:
+        model.initial_state = {
+            **initial_state,
+            "rng": type(initial_state["rng"])(seed),
+        }
+
+    if spec["sizes"] is None:
+        sizes = importlib.import_module("system").sizes
+    else:
+        sizes = spec["sizes"]
+
+    params = {**spec["params"], **extra}
+    state = spec["populate"](model, params, n)
+
+    (blocks, profile) = instrument(model.state_update_blocks, sizes)
+    run = steps(state, blocks, params)
+
+    for state in islice(run, warmup):
+        pass
+
+    profile.reset()
+    start = perf_counter()
+
+    for state in islice(run, ticks):
+        pass
+
+    seconds = perf_counter() - start
+    summary = profile.summary()
+    timeline = profile.timeline()
+    per_block = {}
+
+    for (function, calls, spent, mean, share) in summary:
+        block = function.split(" ")[0]
+        per_block[block] = per_block.get(block, 0) + spent / ticks
+
+    # ru_maxrss is in KiB on Linux, and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak /= 2**20 if sys.platform == "darwin" else 2**10
+
+    return {
+        "model": name,
+        "size": n,
+        "ticks": ticks,
+        "seconds": seconds,
+        "ticks_per_second": ticks / seconds,
+        "peak_rss_mb": peak,
+        # The average size of the state over the timed ticks
+        "sizes": {k: float(np.mean(timeline[k])) for k in sizes},
+        # Seconds spent per tick
+        "blocks": dict(sorted(per_block.items(), key=lambda kv: int(kv[0]))),
+        "functions": {
+            function: spent / ticks for (function, _, spent, _, _) in summary
+        },
+    }
+
+
+def exponents(results, floor=0.01):
+    """
+    Get, per model and function, the exponent k that best fits the time it
+    takes per tick to size ** k, across population sizes (e.g., 1 for a
+    function that is linear in the population, 2 for a quadratic one).
+
+    Functions that take less than floor of a tick at the largest size are left
+    out, as their times are mostly noise.
+    """
+    fitted = {}
+
+    for name in sorted({r["model"] for r in results}):
+        runs = sorted(
+            (r for r in results if r["model"] == name), key=lambda r: r["size"]
+        )
+
+        if len(runs) < 2:
+            continue
+
+        largest = runs[-1]
+        tick = sum(largest["functions"].values())
+        fitted[name] = {}
+
+        for (function, spent) in largest["functions"].items():
+            if spent < floor * tick:
+                continue
+
+            points = [
+                (np.log(r["size"]), np.log(r["functions"][function]))
+                for r in runs
+                if r["functions"].get(function, 0) > 0
+            ]
+
+            if len(points) < 2:
+                continue
+
+            (x, y) = zip(*points)
+            fitted[name][function] = float(np.polyfit(x, y, 1)[0])
+
+    return fitted
+
+
+def regressions(current, baseline, growth=0.5, slowdown=1.5):
+    """
+    Compare benchmark results to those of an earlier commit, and describe every
+    function whose exponent (see exponents) grew by more than growth, and every
+    population size that runs slowdown times slower than it did.
+    """
+    flags = []
+
+    for (name, functions) in current["exponents"].items():
+        for (function, k) in functions.items():
+            before = baseline["exponents"].get(name, {}).get(function)
+
+            if before is not None and k - before > growth:
+                flags.append(
+                    f"{name}: {function} went from O(n^{before:.2f}) to O(n^{k:.2f})"
+                )
+
+    before = {(r["model"], r["size"]): r for r in baseline["results"]}
+
+    for r in current["results"]:
+        old = before.get((r["model"], r["size"]))
+
+        if (
+            old is not None
+            and old["ticks_per_second"] > slowdown * r["ticks_per_second"]
+        ):
+            flags.append(
+                f"{r['model']} at {r['size']}: {old['ticks_per_second']:.1f} -> "
+                f"{r['ticks_per_second']:.1f} ticks per second"
+            )
+
+    return flags
+
+
+def commit():
+    """Get the commit the benchmarks are run at, if in a git repository."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=HERE,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("models", nargs="*", default=[*MODELS], help=", ".join(MODELS))
+    parser.add_argument("--sizes", type=int, nargs="+", help="population sizes")
+    parser.add_argument("--ticks", type=int, default=20, help="ticks to time")
+    parser.add_argument("--warmup", type=int, default=10, help="ticks to run first")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--params", type=json.loads, default={}, help="as JSON")
+    parser.add_argument("--out", default="bench.json", help="where to write results")
+    parser.add_argument("--baseline", help="results of an earlier commit")
+    args = parser.parse_args()
+
+    for name in args.models:
+        if name not in MODELS:
+            parser.error(f"Unknown model: {name}")
+
+    tasks = [
+        (name, n, args.ticks, args.warmup, args.seed, args.params)
+        for name in args.models
+        for n in args.sizes or MODELS[name]["default_sizes"]
+    ]
+    results = []
+
+    # One process per run, one at a time, so that runs neither share memory
+    # (or the actors package) nor compete for the CPU
+    with get_context("spawn").Pool(1, maxtasksperchild=1) as pool:
+        for r in pool.imap(bench, tasks):
+            slowest = max(r["blocks"], key=r["blocks"].get)
+            print(
+                f"{r['model']:<8} {r['size']:>8} {r['ticks_per_second']:>10.2f} "
+                f"ticks/s {r['peak_rss_mb']:>8.1f} MiB peak, block {slowest} "
+                f"takes {r['blocks'][slowest] / sum(r['blocks'].values()):.0%}"
+            )
+            results.append(r)
+
+    current = {
+        "commit": commit(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+        "exponents": exponents(results),
+    }
+
+    for (name, functions) in current["exponents"].items():
+        for (function, k) in sorted(functions.items(), key=lambda kv: -kv[1]):
+            print(f"{name:<8} O(n^{k:.2f}) {function}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+
+    with open(args.out, "w") as f:
+        json.dump(current, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            flags = regressions(current, json.load(f))
+
+        for flag in flags:
+            print("regression:", flag)
+
+        sys.exit(1 if len(flags) > 0 else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Writes checkpoints of a run's state, and resumes runs from them."""
+from concurrent.futures import ThreadPoolExecutor
+import copyreg
+import io
+import os
+import pickle
+import random
+import zlib
+import numpy as np
+from engine import steps
+
+
+def dumps(state):
+    """
+    Serialize a state, along with the state of Python's and NumPy's global
+    random number generators.
+
+    State variables with a checkpoint method (e.g., random streams) are
+    pickled with it, in place of how they are usually pickled.
+    """
+    f = io.BytesIO()
+    pickler = pickle.Pickler(f, pickle.HIGHEST_PROTOCOL)
+    pickler.dispatch_table = copyreg.dispatch_table | {
+        type(value): type(value).checkpoint
+        for value in state.values()
+        if hasattr(value, "checkpoint")
+    }
+    pickler.dump(
+        {
+            "state": state,
+            "random": random.getstate(),
+            "numpy": np.random.get_state(),
+        }
+    )
+
+    return f.getvalue()
+
+
+def save(path, data, level=1):
+    """
+    Compress and write out a serialized state. The checkpoint is written to a
+    temporary file first, so that a crash never leaves half of one behind.
+    """
+    with open(path + ".tmp", "wb") as f:
+        f.write(zlib.compress(data, level))
+
+    os.replace(path + ".tmp", path)
+
+
+def load(path):
+    """
+    Read the state saved in a checkpoint, and set Python's and NumPy's global
+    random number generators back to where they were when it was saved.
+    """
+    with open(path, "rb") as f:
+        checkpoint = pickle.loads(zlib.decompress(f.read()))
+
+    random.setstate(checkpoint["random"])
+    np.random.set_state(checkpoint["numpy"])
+
+    return checkpoint["state"]
+
+
+def latest(path):
+    """Get the path of the latest checkpoint in a directory, or None."""
+    ticks = [
+        int(name[: -len(".ckpt")])
+        for name in os.listdir(path)
+        if name.endswith(".ckpt")
+    ]
+
+    return os.path.join(path, f"{max(ticks)}.ckpt") if len(ticks) > 0 else None
+
+
+def resume(path, state_update_blocks, params, **kwargs):
+    """
+    Pick a run back up from the latest checkpoint in a directory (see
+    Checkpointer), yielding the state after each timestep from there on, as
+    engine.steps does. The state's timestep is the tick it was saved at.
+    """
+    return steps(load(latest(path)), state_update_blocks, params, **kwargs)
+
+
+class Checkpointer:
+    """
+    Saves the state of a run to a directory every few ticks, keeping the
+    latest few checkpoints only.
+
+    The state is serialized on the main loop, as state update functions change
+    it in place, but compressed and written out on a background thread, which
+    the main loop only waits on if the last checkpoint is still being written
+    when the next one is due.
+    """
+
+    def __init__(self, path, every, keep=2, level=1):
+        """
+        Take the directory to write to, how many ticks apart checkpoints are,
+        how many to keep, and the zlib compression level to write them at.
+        """
+        os.makedirs(path, exist_ok=True)
+
+        self.path = path
+        self.every = every
+        self.keep = keep
+        self.level = level
+
+        # Checkpoints written (or left by an earlier run), oldest first
+        self.saved = sorted(
+            (
+                os.path.join(path, name)
+                for name in os.listdir(path)
+                if name.endswith(".ckpt")
+            ),
+            key=lambda name: int(os.path.basename(name)[: -len(".ckpt")]),
+        )
+
+        self.writer = ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, state):
+        """Save the state after a tick, if a checkpoint is due."""
+        if state["timestep"] % self.every != 0:
+            return
+
+        data = dumps(state)
+
+        self.wait()
+        self.pending = self.writer.submit(
+            self.save, os.path.join(self.path, f"{state['timestep']}.ckpt"), data
+        )
+
+    def save(self, path, data):
+        save(path, data, self.level)
+        self.saved.append(path)
+
+        while len(self.saved) > self.keep:
+            os.remove(self.saved.pop(0))
+
+    def wait(self):
+        """Wait for the checkpoint being written, if any, to be written."""
+        if self.pending is not None:
+            self.pending.result()
+            self.pending = None
+
+    def close(self):
+        self.wait()
+        self.writer.shutdown()
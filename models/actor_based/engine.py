@@ -0,0 +1,115 @@
+"""Runs a model's state update blocks without copying its state."""
+from copy import deepcopy
+
+
+def add_signals(signals, other):
+    """Merge the signals of two policies, adding up ones with the same key."""
+    for (key, value) in other.items():
+        if signals.get(key, None):
+            signals[key] += value
+        else:
+            signals[key] = value
+
+    return signals
+
+
+def substep(state, block, params, index, history):
+    """Run one state update block on a state, and get the next state."""
+    policies = [
+        policy(params, index, history, state) for policy in block["policies"].values()
+    ]
+    signals = {}
+
+    if len(policies) == 1:
+        signals = policies[0]
+    else:
+        for signal in policies:
+            add_signals(signals, signal)
+
+    updated = {}
+
+    for (key, update) in block["variables"].items():
+        (updated_key, value) = update(params, index, history, state, signals)
+
+        if updated_key != key or key not in state:
+            raise KeyError(f"State update function for {key} updated {updated_key}")
+
+        updated[key] = value
+
+    return {**state, **updated}
+
+
+def steps(
+    initial_state,
+    state_update_blocks,
+    params,
+    history=None,
+    record=None,
+    substeps=False,
+):
+    """
+    Run a model one timestep at a time, yielding the state after each one.
+
+    Takes the same initial_state and state_update_blocks as radCAD, and one set
+    of params (a dict of values, not lists of them), and gives policies and
+    state update functions the same arguments, in the same order. The state
+    is copied once, up front. After that, each substep only makes a shallow
+    copy of the state dict, so the copy-on-write contract is that:
+    - policies do not change the state (or only in ways the state update
+      functions of their block overwrite)
+    - a state update function only changes the state variable it updates,
+      which it may do in place
+
+    If a history list is given, what record (a function of the state) returns
+    after each timestep, or each substep if substeps is set, is added to it,
+    grouped by timestep as in radCAD, and handed to policies as
+    state_history. Otherwise nothing is kept, so memory stays flat no matter
+    how many timesteps are run.
+    """
+    state = {
+        **deepcopy(initial_state),
+        "simulation": 0,
+        "subset": 0,
+        "run": 1,
+        "substep": 0,
+        "timestep": initial_state.get("timestep", 0),
+    }
+
+    if history is None:
+        (history, record) = ([], None)
+    elif record is not None:
+        history.append([record(state)])
+
+    while True:
+        timestep = state["timestep"] + 1
+        recorded = []
+
+        for (i, block) in enumerate(state_update_blocks):
+            state = substep(state, block, params, i + 1, history)
+            state["timestep"] = timestep
+            state["substep"] = i + 1
+
+            if record is not None and (substeps or i == len(state_update_blocks) - 1):
+                recorded.append(record(state))
+
+        if record is not None:
+            history.append(recorded)
+
+        yield state
+
+
+def run(initial_state, state_update_blocks, params, timesteps, record=None, **kwargs):
+    """
+    Run a model for some timesteps, and get the final state, and what record
+    returned along the way (see steps).
+    """
+    history = []
+    state = initial_state
+
+    for (_, state) in zip(
+        range(timesteps),
+        steps(initial_state, state_update_blocks, params, history, record, **kwargs),
+    ):
+        pass
+
+    return (state, history)
@@ -1,9 +1,10 @@
 """Implements methods for creating, and managing the buyer actor."""
 
-import random
 from dataclasses import dataclass
-from numpy.random import normal, beta
 from math import ceil
+import numpy as np
+from actors.order_book import OrderBook
+from actors.delta import Delta, apply
 
 
 @dataclass
@@ -55,41 +56,86 @@ def update_funded_balances(params, substep, state_history, prev_state, policy_in
     return ("users", users)
 
 
+def count_new_users(params, n_users):
+    """
+    Get how many users join in one new_user_interval, given how many there are.
+
+    The "user_growth" param picks the model:
+    - "exponential" (the default): every user brings in another one
+    - "capped": exponential, until there are "user_capacity" users
+    - "logistic": grows at "user_growth_rate" per interval, slowing down as the
+      population nears "user_capacity"
+    - "linear": "user_growth_rate" new users per interval
+
+    No model lets the population grow past "max_users", if it is set, which
+    bounds the memory every per-user policy uses.
+    """
+    growth = params.get("user_growth", "exponential")
+    rate = params.get("user_growth_rate", 1)
+    capacity = params.get("user_capacity", 10000)
+
+    if growth == "exponential":
+        n_new = n_users
+    elif growth == "capped":
+        n_new = min(n_users, capacity - n_users)
+    elif growth == "logistic":
+        n_new = ceil(rate * n_users * (1 - n_users / capacity))
+    elif growth == "linear":
+        n_new = rate
+    else:
+        raise ValueError(f"Unknown user growth model: {growth}")
+
+    if "max_users" in params:
+        n_new = min(n_new, params["max_users"] - n_users)
+
+    return max(int(n_new), 0)
+
+
 def generate_users(params, substep, state_history, prev_state):
-    # Add a new user for every user every 3 weeks
-    prev_users = prev_state["users"]
+    # Add new users every 3 weeks, as many as the growth model allows
     new_user_rate = params["new_user_interval"] if "new_user_interval" in params else 10
 
     if prev_state["timestep"] % new_user_rate != 0:
-        return {"user_head": prev_state["user_head"], "users": prev_users}
+        return {"user_head": prev_state["user_head"], "users": Delta()}
 
     (alpha_reneg, beta_reneg) = (
         params["user_timeout_dist"] if "user_timeout_dist" in params else [2, 15]
     )
 
+    n = count_new_users(params, len(prev_state["users"]))
+    head = prev_state["user_head"]
+
+    # Draw every new user's traits at once
+    (normal, beta) = (prev_state["rng"].normal, prev_state["rng"].beta)
+    stinginess = normal(*params.get("user_stinginess_dist", (0, 5)), n)
+    ux_tolerance = beta(alpha_reneg, beta_reneg, n)
+    sell_interval = np.ceil(normal(*params.get("profit_taking_interval", [200, 50]), n))
+    sell_pct = beta(*params.get("profit_taking_amt_dist", [1, 5]), n)
+
     return {
-        "user_head": prev_state["user_head"] * 2,
-        "users": prev_users
-        | {
-            (i + prev_state["user_head"]): Buyer(
-                0,
-                normal(*params.get("user_stinginess_dist", (0, 5))),
-                prev_state["timestep"],
-                0,
-                0,
-                beta(alpha_reneg, beta_reneg),
-                0,
-                ceil(normal(*params.get("profit_taking_interval", [200, 50]))),
-                beta(*params.get("profit_taking_amt_dist", [1, 5])),
-                i + prev_state["user_head"],
-            )
-            for i in range(len(prev_state["users"]))
-        },
+        "user_head": head + n,
+        "users": Delta(
+            added=[
+                Buyer(
+                    0,
+                    stinginess[i].item(),
+                    prev_state["timestep"],
+                    0,
+                    0,
+                    ux_tolerance[i].item(),
+                    0,
+                    int(sell_interval[i]),
+                    sell_pct[i].item(),
+                    head + i,
+                )
+                for i in range(n)
+            ]
+        ),
     }
 
 
 def register_users(params, substep, state_history, prev_state, policy_input):
-    return ("users", policy_input["users"])
+    return ("users", apply(prev_state["users"], policy_input["users"]))
 
 
 def change_user_head(params, substep, state_history, prev_state, policy_input):
@@ -97,23 +143,11 @@ def change_user_head(params, substep, state_history, prev_state, policy_input):
 
 
 def register_orders(params, substep, state_history, prev_state, policy_input):
-    return (
-        "orders",
-        [*prev_state["orders"], *[o for o in policy_input.values() if o is not None]],
-    )
+    return ("orders", apply(prev_state["orders"], policy_input["orders"]))
 
 
 def update_user_balances(params, substep, state_history, prev_state, policy_input):
-    users = prev_state["users"]
-
-    for (buyer, o) in policy_input.items():
-        if o is None:
-            continue
-
-        users[o.buyer].all_orders += 1
-        users[o.buyer].balance -= o.price * o.size
-
-    return ("users", prev_state["users"])
+    return ("users", apply(prev_state["users"], policy_input["users"]))
 
 
 def negotiate_orders(params, substep, state_history, prev_state):
@@ -121,53 +155,62 @@ def negotiate_orders(params, substep, state_history, prev_state):
     # provider, which they may or may not be able to fulfill. Pick the biggest
     # of them in the round, and then re-run next round
     order_options = list(range(len(prev_state["orders"])))
-    random.shuffle(order_options)
-    order_options = [prev_state["orders"][i] for i in order_options]
+    prev_state["rng"].shuffle(order_options)
+    book = OrderBook(prev_state["orders"], order_options)
+
+    # Number of VIS a provider needs to match of a buyer's bid to accept it
+    col_rate = params.get("collateralization_rate", 1.0)
+
+    # The orders each provider took, and the units of capacity and VIS they
+    # spent doing so
+    rounds = []
+
+    for prov in prev_state["providers"].values():
+        taken = []
+        used = 0
+        balance_used = 0
+
+        # Fill up on the least valuable orders we can afford, and stop at the
+        # first one that would put us over our capacity or balance
+        for i in book.eligible(prov.min_fee(params, prev_state)):
+            order = book.orders[i]
+
+            # The provider must stake collateral = 100% of the value of the
+            # contract
+            if (
+                used + order.size + prov.used > prov.capacity
+                or prov.balance - (balance_used + col_rate * order.size * order.price)
+                < 0
+            ):
+                break
+
+            taken.append(i)
+            used += order.size
+            balance_used += col_rate * order.size * order.price
+
+        for i in taken:
+            book.fill(i)
+
+        rounds.append((prov, [book.orders[i] for i in taken], used, balance_used))
 
     # The units of capacity the providers spent, the list of orders that were
-    # filled, and the prices they were filled at
+    # filled, and the prices they were filled at. Later providers' orders come
+    # first. Filled orders leave the book, as do orders whose buyers left
     signal = {
         "filled": {},
         "spent": {},
+        "orders": Delta(
+            removed=(
+                o.id
+                for (o, filled) in zip(book.orders, book.filled)
+                if filled or o.buyer not in prev_state["users"]
+            )
+        ),
     }
 
-    # Number of VIS a provider needs to match of a buyer's bid to accept it
-    col_rate = params.get("collateralization_rate", 1.0)
-
-    for prov in prev_state["providers"].values():
-        mine = [o for o in order_options if o not in signal["filled"]]
-
-        # Choose the most profitable options to fill up our
-        eligible = [x for x in mine if x.price >= prov.min_fee(params, prev_state)]
-
-        # Sort in ascending order to remove least profitable options
-        best = sorted(eligible, key=lambda x: x.price * x.size)
-
-        taken = best
-        used = sum(x.size for x in best)
-
-        # The provider must stake collateral = 100% of the value of the contract
-        balance_used = sum(col_rate * x.size * x.price for x in best)
-
-        # Remove the last profitable options that are above our capacity
-        while (
-            used + prov.used > prov.capacity
-            or prov.balance - balance_used < 0
-            and len(taken) > 0
-        ):
-            freed = taken.pop()
-            used -= freed.size
-            balance_used -= col_rate * freed.size * freed.price
-
-        # Use the determined price to fill all of the orders, and remove the
-        # specified units from the provider
-        signal = {
-            "filled": {**{order: prov for order in taken}, **signal["filled"]},
-            "spent": {
-                prov.id: (used, balance_used),
-                **signal["spent"],
-            },
-        }
+    for (prov, taken, used, balance_used) in reversed(rounds):
+        signal["filled"].update((order, prov) for order in taken)
+        signal["spent"][prov.id] = (used, balance_used)
 
     return signal
 
@@ -185,18 +228,18 @@ def update_last_contract(params, substep, state_history, prev_state, policy_inpu
 
 
 def orphan_bored_users(params, substep, state_history, prev_state, policy_input):
-    users = {}
+    users = prev_state["users"]
 
     # Remove spent balances from users, and kill ones that have gone too long
     # without an accepted order
-    for u in prev_state["users"].values():
+    for u in list(users.values()):
         canceled = policy_input["user_counts"].get(u.id, 0)
         u.unfilled_orders += canceled
 
         # spent = policy_input["user_balances"].get(u.id, 0)
         # u.balance -= spent
 
-        if u.all_orders == 0 or u.unfilled_orders / u.all_orders <= u.ux_tolerance:
-            users[u.id] = u
+        if u.all_orders != 0 and u.unfilled_orders / u.all_orders > u.ux_tolerance:
+            del users[u.id]
 
     return ("users", users)
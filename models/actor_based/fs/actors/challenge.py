@@ -1,7 +1,10 @@
 """Implements wrappers and tokenomics for proof of storage challenges."""
 from dataclasses import dataclass
-from random import randrange, shuffle
 from math import ceil
+import numpy as np
+from actors.store import gather, locate
+from actors.enforcer_pool import EnforcerPool
+from actors.delta import Delta, apply
 
 
 @dataclass
@@ -24,20 +27,21 @@ class Challenge:
 def create_challenges(params, substep, state_history, prev_state):
     """Update the challenge head, and creates new challenges for orders."""
     users = prev_state["users"]
-    challenges = prev_state["challenges"]
-    orders = prev_state["active"]
+    signal = {"users": Delta(), "challenges": Delta(), "active": Delta()}
 
     gas = prev_state["mkt_gprice"] / prev_state["mkt_vprice"]
 
     # Find users who have enough VIS to cover gas costs
-    eligible = list(
-        filter(
-            lambda u: u.balance >= gas,
-            users.values(),
-        )
-    )
+    enforcers = EnforcerPool(users.values(), gas, prev_state["rng"])
 
-    for o in orders:
+    # Allow the user who has the greatest expected outcome from challenging
+    # the storage provider to ask for a proof
+    n_inform = ceil(params.get("challenge_awareness_rate", 0.1) * len(users))
+
+    # Only contracts whose challenge windows are open are looked at
+    for o in prev_state["challenge_schedule"].due(
+        prev_state["timestep"], prev_state["active"]
+    ):
         # Skip orders that already have an active challenge
         if o.id in prev_state["challenges"]:
             continue
@@ -52,61 +56,99 @@ def create_challenges(params, substep, state_history, prev_state):
         ):
             continue
 
-        # Allow the user who has the greatest expected outcome from challenging
-        # the storage provider to ask for a proof
-        n_inform = ceil(params.get("challenge_awareness_rate", 0.1) * len(users))
-
         # See analysis.org. Select only a few users to know about the challenge
-        # being ready
-        aware = eligible[:n_inform]
-        shuffle(aware)
+        # being ready, and then find the most fit for the opportunity
+        i = enforcers.pick(n_inform)
 
-        if len(aware) == 0:
+        if i is None:
             continue
 
-        # And then find the most fit for the opportunity
-        takes_action = sorted(aware, key=lambda u: u.challenges_won, reverse=True)[0]
+        takes_action = enforcers.users[i]
 
-        # Pay the gas
-        takes_action.balance -= gas
-        takes_action.challenges_won -= gas
+        # Pay the gas, and remove the user if they no longer have enough
+        # balance
+        enforcers.charge(i, gas)
 
         # Set the next challenge to the found date
         next_challenge = (
-            randrange(prev_state["timestep"] - o.epoch_created_at, o.next_epoch)
+            prev_state["rng"].randrange(
+                prev_state["timestep"] - o.epoch_created_at, o.next_epoch
+            )
             + o.epoch_created_at
         )
-        o.next_challenge = next_challenge
-        o.challenges_left -= 1
-
-        # Remove the user if they no longer have enough balance
-        if takes_action.balance < prev_state["mkt_gprice"] / prev_state["mkt_vprice"]:
-            eligible.remove(takes_action)
-
-        users[takes_action.id] = takes_action
-        challenges[o.id] = Challenge(
+        signal["active"].modify(
+            o.id, next_challenge=next_challenge, challenges_left=o.challenges_left - 1
+        )
+        signal["users"].modify(
             takes_action.id,
-            o.id,
-            next_challenge,
-            False,
+            balance=enforcers.balances[i],
+            challenges_won=enforcers.won[i],
+        )
+        signal["challenges"].add(
+            Challenge(
+                takes_action.id,
+                o.id,
+                next_challenge,
+                False,
+            ),
+            id=o.id,
         )
 
-    return {"users": users, "challenges": challenges, "active": orders}
+    return signal
 
 
 def spend_challenge_gas(params, substep, state_history, prev_state, policy_input):
-    return ("users", policy_input["users"])
+    return ("users", apply(prev_state["users"], policy_input["users"]))
 
 
 def register_challenges(params, substep, state_history, prev_state, policy_input):
-    return ("challenges", policy_input["challenges"])
+    return ("challenges", apply(prev_state["challenges"], policy_input["challenges"]))
 
 
 def update_challenge_counters(params, substep, state_history, prev_state, policy_input):
-    return ("active", policy_input["active"])
+    return ("active", apply(prev_state["active"], policy_input["active"]))
+
+
+def reschedule_challenges(params, substep, state_history, prev_state, policy_input):
+    schedule = prev_state["challenge_schedule"]
+    schedule.advance(
+        prev_state["timestep"], prev_state["active"], policy_input["active"]
+    )
+
+    return ("challenge_schedule", schedule)
 
 
 def answer_challenges(params, substep, state_history, prev_state):
+    """
+    Resolve open challenges, and let providers that are willing to risk it
+    skip storing files.
+
+    Contracts are resolved as a batch when no provider can change its mind
+    about cheating partway through the tick, and one by one otherwise.
+    """
+    # A provider's min fee only depends on the provider, and the tick's prices
+    min_fees = {
+        id: prov.min_fee(params, prev_state)
+        for (id, prov) in prev_state["providers"].items()
+    }
+
+    answered = batch_answer_challenges(params, prev_state, min_fees)
+
+    if answered is None:
+        return answer_challenges_in_order(params, prev_state, min_fees)
+
+    return answered
+
+
+def batch_answer_challenges(params, prev_state, min_fees):
+    """
+    Resolve every active contract's challenge with array operations.
+
+    Each provider decides whether to cheat once, at the start of the tick.
+    Returns None if that could give a different result than deciding contract
+    by contract: a cheater's payoff shrinking, or the treasury's slashing
+    income moving its own risk threshold.
+    """
     storage_stolen = prev_state["storage_stolen"]
     providers = prev_state["providers"]
     users = prev_state["users"]
@@ -115,32 +157,143 @@ def answer_challenges(params, substep, state_history, prev_state):
     slashed = prev_state["v_slashed"]
     burned = prev_state["v_burned"]
 
-    for i, order in enumerate(prev_state["active"]):
-        epoch_size = 1 / (order.next_epoch - order.epoch_created_at)
-        order_cost = (
-            providers[order.provider].min_fee(params, prev_state)
-            * order.size
-            * epoch_size
+    dist_enf = params.get("slashing_dist_enf", 0.5)
+    dist_dao = params.get("slashing_dist_dao", 0.25)
+
+    if len(active) == 0:
+        return answer_challenges_in_order(params, prev_state, min_fees)
+
+    (ids, prov, buyer, size, price, next_epoch, created) = gather(
+        active,
+        "id",
+        "provider",
+        "buyer",
+        "size",
+        "price",
+        "next_epoch",
+        "epoch_created_at",
+    )
+    (prov_ids, forges_won, risk_tolerance, balance) = gather(
+        providers, "id", "forges_won", "risk_tolerance", "balance"
+    )
+
+    # The position of each contract's provider in the provider columns
+    p = locate(prov_ids, prov)
+    fee = np.array([min_fees[id] for id in prov_ids.tolist()])
+
+    epoch_size = 1 / (next_epoch - created)
+    order_cost = fee[p] * size * epoch_size
+    reaped = size * price
+
+    # Cheat if it has worked so far, within our limits
+    cheats = (forges_won > risk_tolerance * balance)[p]
+    challenged = np.isin(
+        ids, np.fromiter(challenges.keys(), dtype=np.int64, count=len(challenges))
+    )
+
+    lost = cheats & challenged
+    won = cheats & ~challenged
+
+    # Check that nobody's decision would flip partway through
+    if (order_cost[won] < 0).any():
+        return None
+
+    if lost.any():
+        treasury = providers[prev_state["treasury"]]
+
+        if treasury.risk_tolerance != 0 and (prov == treasury.id).any():
+            return None
+
+    # We won
+    storage_stolen = sum(size[won].tolist(), storage_stolen)
+    forges_won = forges_won.astype(np.float64)
+    np.add.at(forges_won, p[won], order_cost[won])
+
+    # New values for the fields of providers and users that changed
+    (prov_delta, user_delta) = (Delta(), Delta())
+
+    for j in np.unique(p[won]).tolist():
+        prov_delta.modify(prov_ids[j].item(), forges_won=forges_won[j].item())
+
+    # We lost this time
+    for i in np.flatnonzero(lost).tolist():
+        (id, reaped_i) = (ids[i].item(), reaped[i].item())
+        challenge = challenges[id]
+
+        # Distribute according to params, and google doc
+        # (burning implicit when initial stake cast)
+        add(
+            users, user_delta, challenge.enforcer, "challenges_won", reaped_i * dist_enf
         )
+        add(providers, prov_delta, prev_state["treasury"], "balance", dist_dao)
+
+        # Record statistics
+        slashed += reaped_i
+        burned += reaped_i * (1 - (dist_enf + dist_dao))
+
+        # Return remaining fee paid
+        add(users, user_delta, buyer[i].item(), "balance", reaped_i)
+
+        # Kill contract, and kill challenge
+        add(providers, prov_delta, prov[i].item(), "used", -size[i].item())
+
+    return {
+        "storage_stolen": storage_stolen,
+        "providers": prov_delta,
+        "users": user_delta,
+        # Challenges that were answered either way, and contracts killed by
+        # lost ones
+        "challenges": Delta(removed=ids[challenged].tolist()),
+        "active": Delta(removed=ids[lost].tolist()),
+        "v_slashed": slashed,
+        "v_burned": burned,
+    }
+
+
+def answer_challenges_in_order(params, prev_state, min_fees):
+    """Resolve every active contract's challenge, one contract at a time."""
+    storage_stolen = prev_state["storage_stolen"]
+    providers = prev_state["providers"]
+    users = prev_state["users"]
+    slashed = prev_state["v_slashed"]
+    burned = prev_state["v_burned"]
+
+    # Contracts killed by a lost challenge, challenges that were answered, and
+    # new values for the fields of providers and users that changed
+    killed = Delta()
+    answered = Delta()
+    (prov_delta, user_delta) = (Delta(), Delta())
+
+    for order in prev_state["active"].values():
+        epoch_size = 1 / (order.next_epoch - order.epoch_created_at)
+        order_cost = min_fees[order.provider] * order.size * epoch_size
         reaped = order.size * order.price
 
+        # As earlier contracts this tick left the provider
+        forges_won = current(providers, prov_delta, order.provider, "forges_won")
+        balance = current(providers, prov_delta, order.provider, "balance")
+
         # Cheat if it has worked so far, within our limits
-        if (
-            providers[order.provider].forges_won
-            > providers[order.provider].risk_tolerance
-            * providers[order.provider].balance
-        ):
+        if forges_won > providers[order.provider].risk_tolerance * balance:
             # We lost this time
             if order.id in prev_state["challenges"]:
                 challenge = prev_state["challenges"][order.id]
 
                 # Distribute according to params, and google doc
                 # (burning implicit when initial stake cast)
-                users[challenge.enforcer].challenges_won += reaped * params.get(
-                    "slashing_dist_enf", 0.5
+                add(
+                    users,
+                    user_delta,
+                    challenge.enforcer,
+                    "challenges_won",
+                    reaped * params.get("slashing_dist_enf", 0.5),
                 )
-                providers[prev_state["treasury"]].balance += params.get(
-                    "slashing_dist_dao", 0.25
+                add(
+                    providers,
+                    prov_delta,
+                    prev_state["treasury"],
+                    "balance",
+                    params.get("slashing_dist_dao", 0.25),
                 )
 
                 # Record statistics
@@ -154,57 +307,93 @@ def answer_challenges(params, substep, state_history, prev_state):
                 )
 
                 # Return remaining fee paid
-                users[order.buyer].balance += reaped
+                add(users, user_delta, order.buyer, "balance", reaped)
 
                 # Kill contract, and kill challenge
-                del challenges[order.id]
-                providers[order.provider].used -= order.size
-                active[i] = None
+                answered.remove(order.id)
+                add(providers, prov_delta, order.provider, "used", -order.size)
+                killed.remove(order.id)
 
                 continue
 
             # We won
             storage_stolen += order.size
-            providers[order.provider].forges_won += order_cost
+            add(providers, prov_delta, order.provider, "forges_won", order_cost)
 
             continue
 
         # Enforcer lost
         if order.id in prev_state["challenges"]:
-            challenge = prev_state["challenges"][order.id]
-
             # Remove the challenge
-            del challenges[order.id]
+            answered.remove(order.id)
 
     return {
         "storage_stolen": storage_stolen,
-        "providers": providers,
-        "users": users,
-        "challenges": challenges,
-        "active": list(filter(lambda x: x is not None, active)),
+        "providers": prov_delta,
+        "users": user_delta,
+        "challenges": answered,
+        "active": killed,
         "v_slashed": slashed,
         "v_burned": burned,
     }
 
 
+def current(actors, delta, id, name):
+    """
+    Get a field of the actor with the given id, as the delta sets it, or as it
+    is if the delta leaves it unchanged.
+    """
+    values = delta.modified.get(id, {})
+
+    return values[name] if name in values else getattr(actors[id], name)
+
+
+def add(actors, delta, id, name, amount):
+    """
+    Set a field of the actor with the given id, in the delta, to what it would
+    be with the amount added to it.
+    """
+    delta.modify(id, **{name: current(actors, delta, id, name) + amount})
+
+
 def steal_storage(params, substep, state_history, prev_state, policy_input):
     return ("storage_stolen", policy_input["storage_stolen"])
 
 
 def slash_providers(params, substep, state_history, prev_state, policy_input):
-    return ("providers", policy_input["providers"])
+    return ("providers", apply(prev_state["providers"], policy_input["providers"]))
 
 
 def reward_enforcers(params, substep, state_history, prev_state, policy_input):
-    return ("users", policy_input["users"])
+    return ("users", apply(prev_state["users"], policy_input["users"]))
 
 
 def kill_challenges(params, substep, state_history, prev_state, policy_input):
-    return ("challenges", policy_input["challenges"])
+    return ("challenges", apply(prev_state["challenges"], policy_input["challenges"]))
 
 
 def remove_slashed_orders(params, substep, state_history, prev_state, policy_input):
-    return ("active", policy_input["active"])
+    return ("active", apply(prev_state["active"], policy_input["active"]))
+
+
+def forget_slashed_orders(params, substep, state_history, prev_state, policy_input):
+    expiries = prev_state["expiries"]
+
+    for id in policy_input["active"].removed:
+        expiries.remove(id)
+
+    return ("expiries", expiries)
+
+
+def unschedule_slashed_orders(
+    params, substep, state_history, prev_state, policy_input
+):
+    schedule = prev_state["challenge_schedule"]
+
+    for id in policy_input["active"].removed:
+        schedule.remove(id)
+
+    return ("challenge_schedule", schedule)
 
 
 def slash_supply(params, substep, state_history, prev_state, policy_input):
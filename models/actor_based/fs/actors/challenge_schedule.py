@@ -0,0 +1,100 @@
+"""Implements a queue of active contracts by when they can next be challenged."""
+from heapq import heappush, heappop
+from actors.store import lookup
+
+
+class ChallengeSchedule:
+    """
+    Queues the ids of active contracts by the tick their next challenge
+    window opens at (next_challenge), so that only contracts that are due are
+    looked at.
+
+    The contracts themselves are looked up in the active contracts once they
+    are due, so the schedule never holds copies that could drift from them.
+    Contracts whose challenges ran out, that expired, or that are no longer
+    active, are dropped once they come up.
+    """
+
+    def __init__(self):
+        # id -> the order the contract became active in
+        self.ranks = {}
+        self.head = 0
+
+        # (tick, id) for each queued contract, with stale entries (for
+        # contracts that were rescheduled or removed) skipped lazily
+        self.queue = []
+
+        # id -> the tick the contract is queued for
+        self.when = {}
+
+    def __len__(self):
+        return len(self.when)
+
+    def add(self, id, tick):
+        """Queue a newly active contract, due at the given tick."""
+        self.ranks[id] = self.head
+        self.head += 1
+
+        self.push(id, tick)
+
+    def push(self, id, tick):
+        self.when[id] = tick
+        heappush(self.queue, (tick, id))
+
+    def remove(self, id):
+        """Drop the contract with the given id, if it is queued."""
+        if id in self.when:
+            del self.when[id]
+            del self.ranks[id]
+
+    def ids(self, t):
+        """Get the ids of the contracts queued for tick t or before."""
+        # Walk the heap in order without popping it: the frontier holds the
+        # smallest entries not yet visited
+        frontier = [(self.queue[0], 0)] if len(self.queue) > 0 else []
+        due = []
+
+        while len(frontier) > 0:
+            ((tick, id), i) = heappop(frontier)
+
+            if tick > t:
+                break
+
+            if self.when.get(id) == tick:
+                due.append(id)
+
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(self.queue):
+                    heappush(frontier, (self.queue[child], child))
+
+        return due
+
+    def due(self, t, active):
+        """
+        Get the active contracts whose challenge window is open at tick t, in
+        the order they became active.
+        """
+        return lookup(active, sorted(self.ids(t), key=self.ranks.get))
+
+    def advance(self, t, active, challenged):
+        """
+        Requeue every contract that was due at tick t, as of the active
+        contracts with the changes to challenged ones (a delta over them)
+        made. Contracts that cannot be challenged anymore are dropped.
+        """
+        for o in lookup(active, self.ids(t)):
+            values = challenged.modified.get(o.id, {})
+            challenges_left = values.get("challenges_left", o.challenges_left)
+            next_challenge = values.get("next_challenge", o.next_challenge)
+
+            if challenges_left > 0 and t - o.epoch_created_at < o.next_epoch:
+                self.push(o.id, max(next_challenge, t + 1))
+            else:
+                self.remove(o.id)
+
+        # Contracts still queued at or before t are no longer active
+        while len(self.queue) > 0 and self.queue[0][0] <= t:
+            (tick, id) = heappop(self.queue)
+
+            if self.when.get(id) == tick:
+                self.remove(id)
@@ -1,10 +1,12 @@
 """Implements methods for creating, and interacting with contracts."""
 
-from numpy.random import beta, normal
 from dataclasses import dataclass
 from functools import reduce
 from math import floor, ceil
 from itertools import count
+import numpy as np
+from actors.store import ColumnStore, lookup
+from actors.delta import Delta, apply
 
 
 @dataclass
@@ -45,37 +47,61 @@ def update_treasury_balance(params, substep, state_history, prev_state, policy_i
 def remove_fulfilled_orders(params, substep, state_history, prev_state, policy_input):
     return (
         "orders",
-        [
-            o
-            for o in prev_state["orders"]
-            if o not in policy_input["filled"] and o.buyer in prev_state["users"]
-        ],
+        apply(prev_state["orders"], policy_input["orders"]),
+    )
+
+
+def fulfill(order, prov, timestep):
+    """Get the contract an order becomes once a provider fills it."""
+    return Contract(
+        prov.id,
+        order.buyer,
+        order.size,
+        order.size,
+        order.next_epoch + timestep,
+        timestep,
+        order.price,
+        order.challenges_left,
+        order.next_challenge,
+        order.id,
     )
 
 
 def add_fulfilled_orders(params, substep, state_history, prev_state, policy_input):
-    return (
-        "active",
-        [
-            *prev_state["active"],
-            *[
-                Contract(
-                    prov.id,
-                    order.buyer,
-                    order.size,
-                    order.size,
-                    order.next_epoch + prev_state["timestep"],
-                    prev_state["timestep"],
-                    order.price,
-                    order.challenges_left,
-                    order.next_challenge,
-                    order.id,
-                )
-                for (order, prov) in policy_input["filled"].items()
-            ],
-        ],
+    added = Delta(
+        added=(
+            fulfill(order, prov, prev_state["timestep"])
+            for (order, prov) in policy_input["filled"].items()
+        )
     )
 
+    return ("active", apply(prev_state["active"], added))
+
+
+def schedule_fulfilled_orders(
+    params, substep, state_history, prev_state, policy_input
+):
+    """Index the new contracts by the tick they expire at."""
+    expiries = prev_state["expiries"]
+    t = prev_state["timestep"]
+
+    # The contract fulfill makes of an order expires at its epoch_created_at
+    # (t) plus its next_epoch (the order's next_epoch + t)
+    for order in policy_input["filled"]:
+        expiries.add(order.id, t + order.next_epoch + t)
+
+    return ("expiries", expiries)
+
+
+def schedule_challenges(params, substep, state_history, prev_state, policy_input):
+    """Queue the new contracts for challenges."""
+    schedule = prev_state["challenge_schedule"]
+
+    for order in policy_input["filled"]:
+        schedule.add(order.id, order.next_challenge)
+
+    return ("challenge_schedule", schedule)
+
 
 def generate_orders(params, substep, state_history, prev_state):
     # Users get ideas every 10 steps (approximately once every week)
@@ -86,48 +112,55 @@ def generate_orders(params, substep, state_history, prev_state):
     # Assume that an idea generally takes around 20 MiB in total. Use a beta
     # distribution
     # with alpha = 5, and beta = 20 to simulate this
+    (normal, beta) = (prev_state["rng"].normal, prev_state["rng"].beta)
     sizes = map(lambda x: ceil(x * 100), beta(5, 20, len(prev_state["users"])))
 
     # The new starting ID of contracts to create
     base_id = prev_state["order_head"]
 
+    orders = Delta()
+    users = Delta()
+
     # Choose the closest rate to the going market rate that the user can pay
     # (if their balance is not enough to cover it, just use that)
-    return {
-        u: (
-            None
-            if u.last_contract != prev_state["timestep"]
-            else Contract(
+    for (u, size, id) in zip(
+        filter(
+            lambda u: u.last_contract == prev_state["timestep"],
+            prev_state["users"].values(),
+        ),
+        sizes,
+        count(start=base_id),
+    ):
+        size *= 100
+        price = (
+            min(
+                prev_state["mkt_sprice"]
+                * size
+                / (abs(u.stinginess) if u.stinginess < 0 else 1),
+                u.balance,
+            )
+            / size
+        )
+
+        orders.add(
+            Contract(
                 None,
                 u.id,
                 size,
                 size,
                 floor(normal(mu, sig)),
                 prev_state["timestep"],
-                min(
-                    prev_state["mkt_sprice"]
-                    * size
-                    / (abs(u.stinginess) if u.stinginess < 0 else 1),
-                    u.balance,
-                )
-                / size,
+                price,
                 params.get("challenges_per_contract", 8),
                 -1,
                 id,
             )
         )
-        for (u, size, id) in map(
-            lambda u: (u[0], u[1] * 100, u[2]),
-            zip(
-                filter(
-                    lambda u: u.last_contract == prev_state["timestep"],
-                    prev_state["users"].values(),
-                ),
-                sizes,
-                count(start=base_id),
-            ),
+        users.modify(
+            u.id, all_orders=u.all_orders + 1, balance=u.balance - price * size
         )
-    }
+
+    return {"orders": orders, "users": users}
 
 
 def update_market_price(params, substep, state_history, prev_state, policy_input):
@@ -142,21 +175,41 @@ def update_market_price(params, substep, state_history, prev_state, policy_input
 
 
 def orphan_expired_contracts(params, substep, state_history, prev_state):
-    return {
-        "active": {
-            o
-            for o in prev_state["active"]
-            if prev_state["timestep"] - o.epoch_created_at >= o.next_epoch
-            and o.buyer in prev_state["users"]
-        },
-    }
+    # Only contracts due to expire are looked at. Ones whose buyers left are
+    # kept on
+    due = list(prev_state["expiries"].due(prev_state["timestep"]))
+    expired = [
+        o for o in lookup(prev_state["active"], due) if o.buyer in prev_state["users"]
+    ]
+
+    if isinstance(prev_state["active"], ColumnStore):
+        return {"active": prev_state["active"].take([o.id for o in expired])}
+
+    return {"active": set(expired)}
 
 
 def delete_expired_contracts(params, substep, state_history, prev_state, policy_input):
-    return (
-        "active",
-        [o for o in prev_state["active"] if o not in policy_input["active"]],
-    )
+    if isinstance(prev_state["active"], ColumnStore):
+        prev_state["active"].discard(policy_input["active"].ids())
+
+        return ("active", prev_state["active"])
+
+    expired = Delta(removed=(o.id for o in policy_input["active"]))
+
+    return ("active", apply(prev_state["active"], expired))
+
+
+def forget_expired_contracts(
+    params, substep, state_history, prev_state, policy_input
+):
+    expiries = prev_state["expiries"]
+
+    for o in policy_input["active"]:
+        expiries.remove(o.id)
+
+    expiries.advance(prev_state["timestep"])
+
+    return ("expiries", expiries)
 
 
 def renegotiate_orders(params, substep, state_history, prev_state):
@@ -168,7 +221,7 @@ def renegotiate_orders(params, substep, state_history, prev_state):
     )
 
     # Find orders that are eligible for resubmission, and ones that can stay the way they are
-    orders = []
+    orders = Delta()
     users_affected = {}
 
     # User balances changed within this substep
@@ -186,12 +239,11 @@ def renegotiate_orders(params, substep, state_history, prev_state):
                 users_affected[o.buyer] = 0
 
             users_affected[o.buyer] += 1
+            orders.remove(o.id)
 
             continue
 
         if prev_state["timestep"] - o.epoch_created_at < resubmit_dur:
-            orders.append(o)
-
             continue
 
         d_price = (
@@ -215,26 +267,17 @@ def renegotiate_orders(params, substep, state_history, prev_state):
             - d_price * o.size
             < 0
         ):
-            orders.append(o)
-
             continue
 
         d_balances[o.buyer] += d_price * o.size
 
         # Up the user's price by whatever they're willing to go up by
-        orders.append(
-            Contract(
-                o.provider,
-                o.buyer,
-                o.size,
-                o.size,
-                o.next_epoch + (prev_state["timestep"] - o.epoch_created_at),
-                prev_state["timestep"],
-                o.price + d_price,
-                o.challenges_left,
-                o.next_challenge,
-                o.id,
-            )
+        orders.modify(
+            o.id,
+            init_size=o.size,
+            next_epoch=o.next_epoch + (prev_state["timestep"] - o.epoch_created_at),
+            epoch_created_at=prev_state["timestep"],
+            price=o.price + d_price,
         )
 
     return {
@@ -245,25 +288,39 @@ def renegotiate_orders(params, substep, state_history, prev_state):
 
 
 def resubmit_orders(params, substep, state_history, prev_state, policy_input):
-    return ("orders", policy_input["orders"])
+    return ("orders", apply(prev_state["orders"], policy_input["orders"]))
 
 
 def change_order_head(params, substep, state_history, prev_state, policy_input):
-    return ("order_head", prev_state["order_head"] + len(policy_input))
+    return ("order_head", prev_state["order_head"] + len(policy_input["orders"].added))
 
 
 def release_available_installments(
     params, substep, state_history, prev_state, policy_input
 ):
     """Return available stake and fee to provider, and update contract size."""
-    signal = {
-        "providers": {o.id: o for o in prev_state["providers"].values()},
-    }
+    active = prev_state["active"]
+
+    if isinstance(active, ColumnStore):
+        providers = prev_state["providers"]
+        epoch_length = 1 / (
+            active.column("next_epoch") - active.column("epoch_created_at")
+        )
+
+        np.add.at(
+            providers.column("balance"),
+            providers.rows(active.column("provider")),
+            2 * epoch_length * active.column("price"),
+        )
+
+        return ("providers", providers)
+
+    providers = prev_state["providers"]
 
-    for o in prev_state["active"]:
+    for o in prev_state["active"].values():
         epoch_length = 1 / (o.next_epoch - o.epoch_created_at)
 
         # Refund the provider's stake, and dole out their part of the fee
-        signal["providers"][o.provider].balance += 2 * epoch_length * o.price
+        providers[o.provider].balance += 2 * epoch_length * o.price
 
-    return ("providers", signal["providers"])
+    return ("providers", providers)
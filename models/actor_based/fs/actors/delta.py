@@ -0,0 +1,67 @@
+"""Implements in-place updates to the containers of actors in the state."""
+from actors.store import ColumnStore
+
+
+class Delta:
+    """
+    A change to a container of actors (a dict of id -> actor, a list of
+    actors, or a ColumnStore): actors to add, the ids of actors to remove, and
+    new values for fields of existing actors.
+
+    Policies emit deltas instead of rebuilt containers, and state update
+    functions apply them in place, so the work done per tick follows what
+    changed, not how many actors there are. New values are absolute, so
+    applying a delta to a state the policy already changed is harmless.
+    """
+
+    def __init__(self, added=(), removed=(), modified=None):
+        # (id, actor) pairs, in the order they are to be added
+        self.added = [(getattr(actor, "id"), actor) for actor in added]
+        self.removed = set(removed)
+
+        # id -> (field -> new value)
+        self.modified = {} if modified is None else modified
+
+    def __len__(self):
+        return len(self.added) + len(self.removed) + len(self.modified)
+
+    def add(self, actor, id=None):
+        """Add an actor, under its id, unless another id is given."""
+        self.added.append((actor.id if id is None else id, actor))
+
+    def remove(self, id):
+        self.removed.add(id)
+
+    def modify(self, id, **values):
+        """Set fields of the actor with the given id."""
+        self.modified.setdefault(id, {}).update(values)
+
+
+def apply(actors, delta):
+    """Apply a delta to a dict, list or store of actors in place, and return it."""
+    if len(delta.modified) > 0:
+        if isinstance(actors, list):
+            found = {a.id: a for a in actors if a.id in delta.modified}
+        else:
+            found = {id: actors[id] for id in delta.modified}
+
+        for (id, values) in delta.modified.items():
+            for (name, value) in values.items():
+                setattr(found[id], name, value)
+
+    if len(delta.removed) > 0:
+        if isinstance(actors, list):
+            actors[:] = [a for a in actors if a.id not in delta.removed]
+        elif isinstance(actors, ColumnStore):
+            actors.discard(list(delta.removed))
+        else:
+            for id in delta.removed:
+                del actors[id]
+
+    for (id, actor) in delta.added:
+        if isinstance(actors, list):
+            actors.append(actor)
+        else:
+            actors[id] = actor
+
+    return actors
@@ -0,0 +1,145 @@
+"""Implements an index of the users able to act as challenge enforcers."""
+
+
+class EnforcerPool:
+    """
+    Ranks users who can afford the gas for a challenge by challenges won.
+
+    Users keep the order they were listed in. Only the first few of them (the
+    ones aware of a challenge) compete for each one, so the pool answers "who
+    among the first n has won the most?" from a segment tree over positions,
+    in O(log U) per challenge. Users that can no longer afford gas are
+    evicted.
+
+    The pool keeps its own copy of each user's balance and challenges won, and
+    leaves the users themselves unchanged.
+    """
+
+    def __init__(self, users, gas, rng):
+        """
+        Take the users (in order), the gas a challenge costs, and the random
+        stream to break ties with.
+        """
+        self.users = [u for u in users if u.balance >= gas]
+        self.rng = rng
+
+        # What each user is left with after the gas they paid so far
+        self.balances = [u.balance for u in self.users]
+        self.won = [u.challenges_won for u in self.users]
+
+        self.size = 1
+        while self.size < len(self.users):
+            self.size *= 2
+
+        # Per node: the most challenges won by a user below the node, how many
+        # users below it share that number, and how many users are below it
+        self.best = [float("-inf")] * (2 * self.size)
+        self.ties = [0] * (2 * self.size)
+        self.alive = [0] * (2 * self.size)
+
+        for (i, u) in enumerate(self.users):
+            leaf = self.size + i
+            self.best[leaf] = u.challenges_won
+            self.ties[leaf] = 1
+            self.alive[leaf] = 1
+
+        for node in reversed(range(1, self.size)):
+            self.pull(node)
+
+    def __len__(self):
+        return self.alive[1]
+
+    def pull(self, node):
+        (left, right) = (2 * node, 2 * node + 1)
+        best = max(self.best[left], self.best[right])
+
+        self.best[node] = best
+        self.ties[node] = (self.ties[left] if self.best[left] == best else 0) + (
+            self.ties[right] if self.best[right] == best else 0
+        )
+        self.alive[node] = self.alive[left] + self.alive[right]
+
+    def set(self, i, challenges_won, alive=True):
+        """Update the rank of the user at position i, or evict them."""
+        node = self.size + i
+        self.best[node] = challenges_won if alive else float("-inf")
+        self.ties[node] = int(alive)
+        self.alive[node] = int(alive)
+
+        node //= 2
+        while node > 0:
+            self.pull(node)
+            node //= 2
+
+    def nth(self, n):
+        """Get the position of the nth (from 0) user still in the pool."""
+        node = 1
+        while node < self.size:
+            if self.alive[2 * node] > n:
+                node = 2 * node
+            else:
+                n -= self.alive[2 * node]
+                node = 2 * node + 1
+
+        return node - self.size
+
+    def pick(self, n_aware):
+        """
+        Get the position of the user who has won the most challenges among the
+        first n_aware users in the pool, choosing among ties at random. None if
+        the pool is empty.
+        """
+        if n_aware <= 0 or len(self) == 0:
+            return None
+
+        end = self.nth(min(n_aware, len(self)) - 1) + 1
+
+        # The nodes spanning positions [0, end), from left to right
+        spans = []
+        (lo, hi) = (self.size, self.size + end)
+        right = []
+        while lo < hi:
+            if lo % 2 == 1:
+                spans.append(lo)
+                lo += 1
+            if hi % 2 == 1:
+                hi -= 1
+                right.append(hi)
+            lo //= 2
+            hi //= 2
+        spans += reversed(right)
+
+        best = max(self.best[node] for node in spans)
+        ties = sum(self.ties[node] for node in spans if self.best[node] == best)
+        k = self.rng.randrange(ties) if ties > 1 else 0
+
+        # Find the kth of the tied users
+        for node in spans:
+            if self.best[node] != best:
+                continue
+
+            if k >= self.ties[node]:
+                k -= self.ties[node]
+
+                continue
+
+            while node < self.size:
+                left = 2 * node
+
+                if self.best[left] == best and k < self.ties[left]:
+                    node = left
+                else:
+                    k -= self.ties[left] if self.best[left] == best else 0
+                    node = left + 1
+
+            return node - self.size
+
+    def charge(self, i, gas):
+        """
+        Make the user at position i pay gas for a challenge, and evict them if
+        they cannot afford another one.
+        """
+        self.balances[i] -= gas
+        self.won[i] -= gas
+
+        self.set(i, self.won[i], self.balances[i] >= gas)
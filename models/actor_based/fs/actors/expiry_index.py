@@ -0,0 +1,76 @@
+"""Implements an index of active contracts by the tick they expire at."""
+from heapq import heappush, heappop
+
+
+class ExpiryIndex:
+    """
+    Buckets the ids of active contracts by the tick they expire at
+    (epoch_created_at + next_epoch), with a heap of the ticks that have a
+    bucket. The contracts themselves are looked up in the active contracts
+    once they are due.
+
+    Finding the contracts due at a tick only walks the buckets at or before
+    it, so expiring contracts costs O(expired) per tick, plus O(log T) per
+    bucket, instead of a scan of every active contract. Contracts stay in the
+    index until they are removed, so a due contract that is not expired yet
+    (e.g., its buyer left) keeps coming up every tick.
+    """
+
+    def __init__(self):
+        # tick -> ids of the contracts expiring then
+        self.buckets = {}
+
+        # The ticks with a bucket, as a heap
+        self.ticks = []
+
+        # id -> the tick the contract expires at
+        self.expires = {}
+
+    def __len__(self):
+        return len(self.expires)
+
+    def __contains__(self, id):
+        return id in self.expires
+
+    def add(self, id, tick):
+        """Add the contract with the given id, due at the given tick."""
+        if tick not in self.buckets:
+            self.buckets[tick] = set()
+            heappush(self.ticks, tick)
+
+        self.buckets[tick].add(id)
+        self.expires[id] = tick
+
+    def remove(self, id):
+        """Remove the contract with the given id, if it is in the index."""
+        tick = self.expires.pop(id, None)
+
+        if tick is not None:
+            self.buckets[tick].discard(id)
+
+    def due(self, t):
+        """Iterate over the ids of contracts expiring at or before tick t, by tick."""
+        # Walk the heap in order without popping it: the frontier holds the
+        # smallest ticks not yet visited
+        frontier = [(self.ticks[0], 0)] if len(self.ticks) > 0 else []
+
+        while len(frontier) > 0:
+            (tick, i) = heappop(frontier)
+
+            if tick > t:
+                return
+
+            yield from sorted(self.buckets[tick])
+
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(self.ticks):
+                    heappush(frontier, (self.ticks[child], child))
+
+    def advance(self, t):
+        """
+        Drop the buckets at or before tick t. Contracts still in them are
+        carried over to tick t + 1, so they come up as due again.
+        """
+        while len(self.ticks) > 0 and self.ticks[0] <= t:
+            for id in self.buckets.pop(heappop(self.ticks)):
+                self.add(id, t + 1)
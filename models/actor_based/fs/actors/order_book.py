@@ -0,0 +1,127 @@
+"""Implements a price-indexed book of open storage orders."""
+import numpy as np
+
+
+class OrderBook:
+    """
+    Indexes a tick's open orders by value (price * size), and, over that
+    order, by price.
+
+    Orders are referred to by their position in the list the book was built
+    from. The price index is a max segment tree over the orders in value
+    order, with filled orders' prices set to -inf, so that the next unfilled
+    order paying at least a provider's min fee is found in O(log n), without
+    walking the orders that pay less. A provider that takes k orders costs
+    O((k + 1) log n), instead of a scan of the whole book.
+    """
+
+    def __init__(self, orders, arrival):
+        """
+        Take the open orders, and the order (as a list of positions in orders)
+        in which they reached providers.
+
+        Orders of equal value are matched in arrival order.
+        """
+        self.orders = orders
+        self.filled = [False] * len(orders)
+        self.n_filled = 0
+
+        rank = [0] * len(orders)
+        for (pos, i) in enumerate(arrival):
+            rank[i] = pos
+
+        # Ascending by value, so the least valuable orders are taken first
+        self.by_value = sorted(
+            range(len(orders)),
+            key=lambda i: (orders[i].price * orders[i].size, rank[i]),
+        )
+
+        # where each order is in by_value
+        self.at = [0] * len(orders)
+        for (pos, i) in enumerate(self.by_value):
+            self.at[i] = pos
+
+        # The segment tree: leaf size + pos holds the price of by_value[pos],
+        # and every other node the highest price below it
+        self.size = 1
+        while self.size < len(orders):
+            self.size *= 2
+
+        tree = np.full(2 * self.size, -np.inf)
+        tree[self.size : self.size + len(orders)] = [
+            orders[i].price for i in self.by_value
+        ]
+
+        n = self.size
+        while n > 1:
+            tree[n // 2 : n] = np.maximum(tree[n : 2 * n : 2], tree[n + 1 : 2 * n : 2])
+            n //= 2
+
+        # Python floats are faster to walk one at a time than NumPy's
+        self.tree = tree.tolist()
+
+    def __len__(self):
+        return len(self.orders) - self.n_filled
+
+    def best_price(self):
+        """Get the highest price bid by an unfilled order, or None."""
+        return None if len(self) == 0 else self.tree[1]
+
+    def next(self, pos, min_fee):
+        """
+        Get the first position in by_value, from pos on, of an unfilled order
+        paying at least min_fee, or None.
+        """
+        tree = self.tree
+
+        if pos >= self.size:
+            return None
+
+        i = pos + self.size
+
+        # Climb to the first subtree to the right holding such an order
+        while tree[i] < min_fee:
+            while i & 1:
+                i >>= 1
+
+            if i == 0:
+                return None
+
+            i += 1
+
+        # And descend to its leftmost one
+        while i < self.size:
+            i = 2 * i if tree[2 * i] >= min_fee else 2 * i + 1
+
+        return i - self.size
+
+    def eligible(self, min_fee):
+        """
+        Iterate over the positions of unfilled orders paying at least min_fee,
+        from least to most valuable.
+        """
+        pos = self.next(0, min_fee)
+
+        while pos is not None:
+            yield self.by_value[pos]
+            pos = self.next(pos + 1, min_fee)
+
+    def fill(self, i):
+        """Remove the order at position i from the book."""
+        if self.filled[i]:
+            return
+
+        self.filled[i] = True
+        self.n_filled += 1
+
+        tree = self.tree
+        j = self.at[i] + self.size
+        tree[j] = -np.inf
+
+        while j > 1:
+            j >>= 1
+            tree[j] = max(tree[2 * j], tree[2 * j + 1])
+
+    def unfilled(self):
+        """Get the orders that have not been filled, in their original order."""
+        return [o for (o, filled) in zip(self.orders, self.filled) if not filled]
@@ -1,7 +1,8 @@
 from dataclasses import dataclass
-from random import random
-from numpy.random import beta, normal
 from math import pow, ceil
+import numpy as np
+from actors.store import ColumnStore
+from actors.delta import Delta, apply
 
 
 @dataclass
@@ -21,7 +22,7 @@ class Provider:
 
     # Last time the provider received an order, number of timesteps it can go
     # without an order before "going out of business"
-    timeout_dir: int
+    timeout_dir: float
     last_order: int
 
     # The value the provider has received by NOT actually storing the file
@@ -73,7 +74,9 @@ def fund_users(params, substep, state_history, prev_state):
             continue
 
         grant = min(
-            random() * 0.05 * prev_state["providers"][prev_state["treasury"]].balance,
+            prev_state["rng"].random()
+            * 0.05
+            * prev_state["providers"][prev_state["treasury"]].balance,
             grants_available - total_doled,
         )
 
@@ -101,6 +104,15 @@ def update_expired_provider_capacities(
 ):
     providers = prev_state["providers"]
 
+    if isinstance(policy_input["active"], ColumnStore):
+        np.subtract.at(
+            providers.column("used"),
+            providers.rows(policy_input["active"].column("provider")),
+            policy_input["active"].column("size"),
+        )
+
+        return ("providers", providers)
+
     # Remove the spent capacities for each order that is past expiry
     for o in policy_input["active"]:
         providers[o.provider].used -= o.size
@@ -115,14 +127,14 @@ def generate_providers(params, substep, state_history, prev_state):
     """
 
     prev_head = prev_state["provider_head"]
-    prev_provs = prev_state["providers"]
 
     if prev_state["timestep"] % params.get("new_provider_interval", 60) != 0:
-        return {"providers": prev_provs, "provider_head": prev_head}
+        return {"providers": Delta(), "provider_head": prev_head}
 
     alpha_sinit_dist, beta_sinit_dist = params.get("provider_init_storage_dist", (5, 5))
+    (normal, beta) = (prev_state["rng"].normal, prev_state["rng"].beta)
 
-    prev_provs[prev_head] = Provider(
+    new_prov = Provider(
         0,
         beta(alpha_sinit_dist, beta_sinit_dist) * 122070,
         0,
@@ -137,13 +149,13 @@ def generate_providers(params, substep, state_history, prev_state):
     )
 
     return {
-        "providers": prev_provs,
+        "providers": Delta(added=[new_prov]),
         "provider_head": prev_head + 1,
     }
 
 
 def register_providers(params, substep, state_history, prev_state, policy_input):
-    return ("providers", policy_input["providers"] | prev_state["providers"])
+    return ("providers", apply(prev_state["providers"], policy_input["providers"]))
 
 
 def change_provider_head(params, substep, state_history, prev_state, policy_input):
@@ -157,44 +169,42 @@ def resize_prov_sectors(params, substep, state_history, prev_state):
     Depends on whether the provider is ready to reassess its profitability or
     and whether or not it is profitable.
     """
-    providers = prev_state["providers"].copy()
+    resized = Delta()
 
     for prov in prev_state["providers"].values():
         last = prov.last_order
         if prev_state["timestep"] - last < prov.timeout_dir:
             continue
 
-        prov.last_order = prev_state["timestep"]
+        resized.modify(prov.id, last_order=prev_state["timestep"])
 
         # The user must shut down
         if prov.capacity == 0:
-            del providers[prov.id]
+            resized.remove(prov.id)
 
             continue
 
         # The user must decrease their capacity
         if prov.capacity - prov.used > 0:
-            prov.capacity = prov.used
+            resized.modify(prov.id, capacity=prov.used)
 
             continue
 
         # Increase the producer's capacity by however much space wasn't filled
         # since the last adjustment
-        since_history = list(
-            map(lambda s: s[-1], state_history[last : prev_state["timestep"]])
-        )
-        prov.capacity += max(
-            sum(
-                sum(o.size for o in state["orders"])
-                - sum(prov.capacity for prov in state["providers"].values())
-                for state in since_history
-            )
-            / len(since_history),
-            0,
+        resized.modify(
+            prov.id,
+            capacity=prov.capacity
+            + max(
+                prev_state["history"].average(
+                    "unmet_demand", last, prev_state["timestep"]
+                ),
+                0,
+            ),
         )
 
-    return {"providers": providers}
+    return {"providers": resized}
 
 
 def apply_sector_resize(params, substep, state_history, prev_state, policy_input):
-    return ("providers", policy_input["providers"])
+    return ("providers", apply(prev_state["providers"], policy_input["providers"]))
@@ -0,0 +1,358 @@
+"""Implements columnar (struct-of-arrays) storage for actors."""
+from dataclasses import fields, is_dataclass
+import numpy as np
+
+# The column type used for each annotated field type. Anything else is stored
+# as a Python object
+DTYPES = {float: np.float64, int: np.int64, bool: np.bool_}
+
+# Row view classes, by actor class
+row_types = {}
+
+
+def row_type(kind):
+    """
+    Get the row view class for an actor class.
+
+    Row views subclass the actor class, so isinstance checks, methods like
+    Provider.min_fee, __hash__ and __eq__ all work on them, but every field is
+    read from, and written to, the store's columns.
+    """
+    if kind in row_types:
+        return row_types[kind]
+
+    def column(name):
+        def get(self):
+            return self._store.columns[name].item(self._store.row(self._id))
+
+        def put(self, value):
+            self._store.columns[name][self._store.row(self._id)] = value
+
+        return property(get, put)
+
+    row_types[kind] = type(
+        kind.__name__ + "Row",
+        (kind,),
+        {
+            "__slots__": ("_store", "_id"),
+            "__reduce__": lambda self: (view, (self._store, self._id)),
+            **{f.name: column(f.name) for f in fields(kind)},
+        },
+    )
+
+    return row_types[kind]
+
+
+def view(store, id):
+    """Get a view of the row with the given ID."""
+    row = object.__new__(row_type(store.kind))
+    row._store = store
+    row._id = id
+
+    return row
+
+
+def gather(actors, *names):
+    """
+    Get fields of a store, or of a dict or list of actors, as arrays (one per
+    field name).
+    """
+    if isinstance(actors, ColumnStore):
+        return tuple(actors.column(name) for name in names)
+
+    if isinstance(actors, dict):
+        actors = actors.values()
+
+    actors = list(actors)
+
+    return tuple(np.array([getattr(a, name) for a in actors]) for name in names)
+
+
+def lookup(actors, ids):
+    """
+    Get the actors with the given ids, skipping ids no actor has: as a store,
+    from a store, or as a list, from a dict or list of actors (which is
+    scanned, as lists are not indexed).
+    """
+    if isinstance(actors, ColumnStore):
+        ids = np.asarray(ids, dtype=np.int64)
+
+        return actors.take(ids[actors.has_all(ids)])
+
+    if isinstance(actors, dict):
+        return [actors[id] for id in ids if id in actors]
+
+    if len(ids) == 0:
+        return []
+
+    ids = set(ids)
+
+    return [a for a in actors if a.id in ids]
+
+
+def locate(ids, wanted):
+    """Get the position in ids of each of the wanted ids."""
+    order = np.argsort(ids, kind="stable")
+    pos = np.searchsorted(ids, wanted, sorter=order)
+    pos[pos == len(ids)] = 0
+
+    found = ids[order[pos]] == wanted
+    if not found.all():
+        raise KeyError(wanted[~found][0])
+
+    return order[pos]
+
+
+class ColumnStore:
+    """
+    Stores actors of one dataclass type as one NumPy column per field.
+
+    Rows are kept in insertion order, and found by the actor's id field. The
+    store can stand in for both the dicts (id -> actor) and lists of actors
+    the model keeps in its state: iterating over it, or over values(), yields
+    row views in insertion order, and it can be indexed and searched by id.
+
+    Removed rows are flagged, and compacted away once they make up half of the
+    store, or before columns are handed out for vectorized operations.
+    """
+
+    def __init__(self, kind, capacity=16):
+        """Take the dataclass to store, and how many rows to make room for."""
+        assert is_dataclass(kind)
+
+        self.kind = kind
+        self.n = 0
+        self.n_dead = 0
+        self.columns = {
+            f.name: np.zeros(capacity, dtype=DTYPES.get(f.type, object))
+            for f in fields(kind)
+        }
+        self.alive = np.zeros(capacity, dtype=np.bool_)
+
+        # id -> row, or -1 if there is no actor with that id
+        self.index = np.full(capacity, -1, dtype=np.int64)
+
+    @classmethod
+    def of(cls, kind, actors):
+        """Make a store holding copies of the given actors."""
+        store = cls(kind)
+        store.extend(actors)
+
+        return store
+
+    def __len__(self):
+        return self.n - self.n_dead
+
+    def __iter__(self):
+        return self.values()
+
+    def __contains__(self, id):
+        return self.has(getattr(id, "id", id))
+
+    def __getitem__(self, id):
+        if not self.has(id):
+            raise KeyError(id)
+
+        return view(self, id)
+
+    def __setitem__(self, id, actor):
+        if isinstance(actor, row_type(self.kind)) and actor._store is self:
+            if actor._id == id:
+                return
+
+        if self.has(id):
+            row = self.row(id)
+
+            for (name, col) in self.columns.items():
+                col[row] = getattr(actor, name)
+
+            return
+
+        self.append(actor)
+
+    def __delitem__(self, id):
+        row = self.row(id)
+
+        self.alive[row] = False
+        self.index[id] = -1
+        self.n_dead += 1
+
+        if 2 * self.n_dead > self.n:
+            self.compact()
+
+    def __or__(self, other):
+        merged = self.copy()
+        merged.update(other)
+
+        return merged
+
+    def __getstate__(self):
+        self.compact()
+
+        return {
+            "kind": self.kind,
+            "columns": {name: col[: self.n] for (name, col) in self.columns.items()},
+        }
+
+    def __setstate__(self, state):
+        self.kind = state["kind"]
+        self.columns = state["columns"]
+        self.n = len(self.columns["id"])
+        self.n_dead = 0
+        self.alive = np.ones(self.n, dtype=np.bool_)
+        self.index = np.full(0, -1, dtype=np.int64)
+        self.reindex()
+
+    def has(self, id):
+        """Check whether an actor with the given id is stored."""
+        return 0 <= id < len(self.index) and self.index[id] >= 0
+
+    def has_all(self, ids):
+        """Check, for each of an array of ids, whether it is stored."""
+        ids = np.asarray(ids, dtype=np.int64)
+        inside = (ids >= 0) & (ids < len(self.index))
+        found = np.zeros(len(ids), dtype=np.bool_)
+        found[inside] = self.index[ids[inside]] >= 0
+
+        return found
+
+    def row(self, id):
+        """Get the row of the actor with the given id."""
+        if not self.has(id):
+            raise KeyError(id)
+
+        return self.index[id]
+
+    def rows(self, ids):
+        """Get the rows of an array of ids, after compacting the store."""
+        self.compact()
+
+        ids = np.asarray(ids, dtype=np.int64)
+        found = self.has_all(ids)
+
+        if not found.all():
+            raise KeyError(ids[~found][0])
+
+        return self.index[ids]
+
+    def column(self, name):
+        """
+        Get a writable view of a column, after compacting the store, so that
+        its rows line up with the order actors are iterated in.
+        """
+        self.compact()
+
+        return self.columns[name][: self.n]
+
+    def ids(self):
+        return self.column("id")
+
+    def keys(self):
+        return iter(self.ids().tolist())
+
+    def values(self):
+        ids = self.columns["id"][: self.n][self.alive[: self.n]]
+
+        return (view(self, id) for id in ids.tolist())
+
+    def items(self):
+        return ((row.id, row) for row in self.values())
+
+    def append(self, actor):
+        """Add an actor (any object with the stored fields) as a new row."""
+        id = getattr(actor, "id")
+        assert not self.has(id)
+
+        self.grow(self.n + 1, id + 1)
+
+        for (name, col) in self.columns.items():
+            col[self.n] = getattr(actor, name)
+
+        self.alive[self.n] = True
+        self.index[id] = self.n
+        self.n += 1
+
+    def extend(self, actors):
+        for actor in actors:
+            self.append(actor)
+
+    def update(self, actors):
+        """Add or overwrite actors, from a dict of id -> actor, or a store."""
+        for (id, actor) in actors.items():
+            self[id] = actor
+
+    def discard(self, ids):
+        """Remove the actors with the given ids, if they are stored."""
+        ids = np.asarray(ids, dtype=np.int64)
+        ids = ids[self.has_all(ids)]
+
+        self.alive[self.index[ids]] = False
+        self.index[ids] = -1
+        self.n_dead += len(np.unique(ids))
+
+        if 2 * self.n_dead > self.n:
+            self.compact()
+
+    def select(self, mask):
+        """Make a new store from the rows where mask (over column()s) is set."""
+        self.compact()
+
+        return self.pick(np.flatnonzero(mask))
+
+    def take(self, ids):
+        """Make a new store from the actors with the given ids, in stored order."""
+        return self.pick(np.sort(self.rows(ids)))
+
+    def pick(self, rows):
+        """Make a new store from the given rows of a compacted store."""
+        picked = ColumnStore(self.kind, max(len(rows), 1))
+        picked.columns = {name: col[rows] for (name, col) in self.columns.items()}
+        picked.n = len(picked.columns["id"])
+        picked.alive = np.ones(picked.n, dtype=np.bool_)
+        picked.reindex()
+
+        return picked
+
+    def copy(self):
+        return self.select(np.ones(len(self), dtype=np.bool_))
+
+    def compact(self):
+        """Drop removed rows, keeping the rest in order."""
+        if self.n_dead == 0:
+            return
+
+        keep = self.alive[: self.n]
+
+        for (name, col) in self.columns.items():
+            live = col[: self.n][keep]
+            col[: len(live)] = live
+
+        self.n -= self.n_dead
+        self.n_dead = 0
+        self.alive[: self.n] = True
+        self.alive[self.n :] = False
+        self.reindex()
+
+    def reindex(self):
+        self.index[:] = -1
+
+        ids = self.columns["id"][: self.n]
+        self.grow(self.n, int(ids.max()) + 1 if self.n > 0 else 0)
+        self.index[ids] = np.arange(self.n)
+
+    def grow(self, n_rows, n_ids):
+        """Make room for at least n_rows rows, and ids below n_ids."""
+        if n_rows > len(self.alive):
+            size = max(n_rows, 2 * len(self.alive))
+
+            for (name, col) in self.columns.items():
+                self.columns[name] = np.resize(col, size)
+
+            self.alive = np.resize(self.alive, size)
+            self.alive[self.n :] = False
+
+        if n_ids > len(self.index):
+            size = max(n_ids, 2 * len(self.index))
+            index = np.full(size, -1, dtype=np.int64)
+            index[: len(self.index)] = self.index
+            self.index = index
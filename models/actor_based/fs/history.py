@@ -0,0 +1,66 @@
+"""Implements a bounded record of aggregates of past ticks."""
+import numpy as np
+
+
+class History:
+    """
+    Records a fixed set of aggregates of each tick's state, for the last few
+    ticks only, in place of the full state history.
+
+    Each aggregate is kept as a ring buffer of running (prefix) sums, so that
+    averaging it over any range of recorded ticks takes O(1), and memory does
+    not grow with the length of a run. The sums are rebased every window
+    ticks, so that they stay about as large as a window's worth of ticks,
+    rather than growing (and losing precision) over a long run.
+    """
+
+    def __init__(self, aggregates, window, start=0):
+        """
+        Take the aggregates to record (name -> function of a state), how many
+        ticks back they can be looked up, and the first tick to be recorded.
+        """
+        self.aggregates = aggregates
+        self.window = window
+        self.start = start
+        self.n = 0
+
+        # totals[k, i % (window + 1)]: aggregate k summed over the first i
+        # ticks, less the same base for every i still in the buffer
+        self.totals = np.zeros((len(aggregates), window + 1))
+
+    def record(self, state):
+        """Add the aggregates of a state, as the next tick."""
+        prev = self.n % (self.window + 1)
+        slot = (self.n + 1) % (self.window + 1)
+
+        for (k, aggregate) in enumerate(self.aggregates.values()):
+            self.totals[k, slot] = self.totals[k, prev] + aggregate(state)
+
+        self.n += 1
+
+        # Take the oldest sum in the buffer off all of them, which leaves the
+        # differences between them as they were
+        if self.n % self.window == 0:
+            oldest = (self.n - self.window) % (self.window + 1)
+            self.totals -= self.totals[:, oldest : oldest + 1]
+
+    def average(self, name, since, until):
+        """
+        Get the average of an aggregate over ticks [since, until). Ticks that
+        have fallen out of the window are left out, and the average of no
+        ticks is 0.
+        """
+        k = list(self.aggregates).index(name)
+        until = min(until - self.start, self.n)
+        since = max(since - self.start, self.n - self.window, 0)
+
+        if until <= since:
+            return 0.0
+
+        return float(
+            (
+                self.totals[k, until % (self.window + 1)]
+                - self.totals[k, since % (self.window + 1)]
+            )
+            / (until - since)
+        )
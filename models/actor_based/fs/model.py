@@ -8,6 +8,8 @@ from system import (
     deliver_user_vis_supply,
     calc_market_vis_price,
     deliver_market_vis_demand,
+    unmet_demand,
+    record_history,
 )
 from actors.challenge import (
     create_challenges,
@@ -22,6 +24,9 @@ from actors.challenge import (
     reward_enforcers,
     kill_challenges,
     remove_slashed_orders,
+    forget_slashed_orders,
+    reschedule_challenges,
+    unschedule_slashed_orders,
 )
 from actors.buyer import (
     Buyer,
@@ -36,6 +41,7 @@ from actors.buyer import (
     update_user_balances,
 )
 from actors.contract import (
+    Contract,
     update_treasury_balance,
     renegotiate_orders,
     resubmit_orders,
@@ -47,6 +53,9 @@ from actors.contract import (
     update_market_price,
     delete_expired_contracts,
     orphan_expired_contracts,
+    forget_expired_contracts,
+    schedule_fulfilled_orders,
+    schedule_challenges,
 )
 from actors.provider import (
     Provider,
@@ -59,40 +68,93 @@ from actors.provider import (
     register_providers,
     change_provider_head,
 )
+from actors.store import ColumnStore
+from actors.expiry_index import ExpiryIndex
+from actors.challenge_schedule import ChallengeSchedule
+from math import ceil
+from dataclasses import replace
+from history import History
+from rng import RandomStream
 
 # Start the system off with just one user, who is providing storage to no one
 treasury = Provider(10000, 51200, 0, 0.0, 1024, 0, 0, 0, 1024, 0.01, 0)
-initial_state = {
-    # Vision DAO provides 100 GiB of storage, at zero fee
-    "treasury": 0,
-    "providers": {0: treasury},
-    "provider_head": 1,
-    "users": {0: Buyer(0, 0, 0, 0, 0, 0, 0, 256, 0.1, 0)},
-    "user_head": 1,
-    "orders": [],
-    "order_head": 0,
-    "active": [],
-    # The prevailing storage price: average over the last few time intervals of
-    # what users' orders were cleared at. Zero, initially, because the treasury
-    # fulfills all orders, unconditionally.
-    "mkt_sprice": 0,
-    # The price of storage in $ / MiB
-    "mkt_fsprice": 0,
-    # The price of an Etheruem transaction in $
-    "mkt_gprice": 0,
-    # The price of 1 VIS (in USD)
-    # Assume an initial market cap of $1,000
-    "mkt_vprice": 10,
-    # Active challenges between an enforcer and a provider
-    "challenges": {},
-    # Number of MiB of data that was NOT served when it should have been per
-    # contract
-    "storage_stolen": 0,
-    # Total number of VIS slashed
-    "v_slashed": 0,
-    # Total number of VIS burned intentionally
-    "v_burned": 0,
-}
+
+# How many ticks back policies look up aggregates of past ticks. Providers
+# average unmet demand over the ticks since they last resized, which is their
+# responsiveness (timeout_dir), rounded up, at most: the treasury's, or 100
+# for generated providers, whose responsiveness is a beta variate times 100
+HISTORY_WINDOW = ceil(max(treasury.timeout_dir, 100))
+
+
+def make_initial_state(columnar=False):
+    """Build a starting state of fresh objects, which no other state shares.
+
+    With columnar set, providers, users and active contracts are kept in
+    columnar stores, which several policies operate on as whole columns. Use
+    that for large populations.
+    """
+    state = {
+        # Vision DAO provides 100 GiB of storage, at zero fee
+        "treasury": 0,
+        "providers": {0: replace(treasury)},
+        "provider_head": 1,
+        "users": {0: Buyer(0, 0, 0, 0, 0, 0, 0, 256, 0.1, 0)},
+        "user_head": 1,
+        "orders": [],
+        "order_head": 0,
+        # Active contracts, by id
+        "active": {},
+        # Active contracts, by the tick they expire at
+        "expiries": ExpiryIndex(),
+        # Active contracts, by when they can next be challenged
+        "challenge_schedule": ChallengeSchedule(),
+        # The prevailing storage price: average over the last few time intervals of
+        # what users' orders were cleared at. Zero, initially, because the treasury
+        # fulfills all orders, unconditionally.
+        "mkt_sprice": 0,
+        # The price of storage in $ / MiB
+        "mkt_fsprice": 0,
+        # The price of an Etheruem transaction in $
+        "mkt_gprice": 0,
+        # The price of 1 VIS (in USD)
+        # Assume an initial market cap of $1,000
+        "mkt_vprice": 10,
+        # Active challenges between an enforcer and a provider
+        "challenges": {},
+        # Number of MiB of data that was NOT served when it should have been per
+        # contract
+        "storage_stolen": 0,
+        # Total number of VIS slashed
+        "v_slashed": 0,
+        # Total number of VIS burned intentionally
+        "v_burned": 0,
+        # Aggregates of past ticks that policies look back on, in place of
+        # state_history
+        "history": History({"unmet_demand": unmet_demand}, HISTORY_WINDOW),
+        # The stream policies draw all of their random numbers from. Replace it
+        # with RandomStream(seed) for a reproducible run. Runs started from the
+        # same state in one process share it, and draw different numbers; runs in
+        # other processes continue it from the same point, so give each its own
+        # (as runner.py does), or build each run's state anew
+        "rng": RandomStream(),
+    }
+
+    if columnar:
+        state = {
+            **state,
+            "providers": ColumnStore.of(Provider, state["providers"].values()),
+            "users": ColumnStore.of(Buyer, state["users"].values()),
+            "active": ColumnStore(Contract),
+        }
+
+    # The initial state counts as the first tick
+    state["history"].record(state)
+
+    return state
+
+
+initial_state = make_initial_state()
+columnar_initial_state = make_initial_state(columnar=True)
 
 state_update_blocks = [
     # Update the global storage price based on the expected discount rate in 2
@@ -148,6 +210,7 @@ state_update_blocks = [
         "variables": {
             "active": delete_expired_contracts,
             "providers": update_expired_provider_capacities,
+            "expiries": forget_expired_contracts,
         },
     },
     # Add 1 new user every 30 ticks
@@ -210,6 +273,8 @@ state_update_blocks = [
             "orders": remove_fulfilled_orders,
             "providers": update_provider_capacities,
             "active": add_fulfilled_orders,
+            "expiries": schedule_fulfilled_orders,
+            "challenge_schedule": schedule_challenges,
             "mkt_sprice": update_market_price,
         },
     },
@@ -224,6 +289,7 @@ state_update_blocks = [
             "users": spend_challenge_gas,
             "challenges": register_challenges,
             "active": update_challenge_counters,
+            "challenge_schedule": reschedule_challenges,
         },
     },
     # Produce a proof if we have one, or don't if we took a risk
@@ -237,6 +303,8 @@ state_update_blocks = [
             "users": reward_enforcers,
             "challenges": kill_challenges,
             "active": remove_slashed_orders,
+            "expiries": forget_slashed_orders,
+            "challenge_schedule": unschedule_slashed_orders,
             "v_slashed": slash_supply,
             "v_burned": burn_supply,
         },
@@ -252,4 +320,12 @@ state_update_blocks = [
             "users": register_transfers_user,
         },
     },
+    # Record the aggregates of this tick that later ticks look back on (e.g.,
+    # how much demand for storage went unmet, for resizing providers)
+    {
+        "policies": {},
+        "variables": {
+            "history": record_history,
+        },
+    },
 ]
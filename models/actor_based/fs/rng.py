@@ -0,0 +1,132 @@
+"""Implements a seeded stream of random numbers that policies draw from."""
+from uuid import uuid4
+from weakref import WeakValueDictionary
+import numpy as np
+
+# Live streams, by key. radCAD hands every policy and state update function a
+# pickled copy of the state, and these let each copy of a stream resolve to
+# the one stream of the run, so that a draw is never repeated
+streams = WeakValueDictionary()
+
+
+def restore(seed, bit_generator, blocks, block, key=None):
+    """Make a stream that picks up where another one was."""
+    stream = RandomStream(seed, block, key)
+    stream.rng.bit_generator.state = bit_generator
+    stream.blocks = blocks
+
+    return stream
+
+
+def shared(key, seed, bit_generator, block):
+    """
+    Get the live stream with the given key, or, in a process it is not live
+    in, pick it up from its generator's state (past the variates it had
+    drawn in blocks, which are not handed out again).
+    """
+    if key in streams:
+        return streams[key]
+
+    return restore(seed, bit_generator, {}, block, key)
+
+
+class RandomStream:
+    """
+    Hands out variates drawn from a seeded numpy.random.Generator.
+
+    Variates are drawn in blocks, one per distribution, and handed out on
+    demand, so that a policy asking for one number at a time does not pay for
+    a NumPy call every time. Normal variates are scaled from a single block of
+    standard normal ones; beta variates come from a block per (alpha, beta).
+
+    It also stands in for the functions of Python's random module the
+    policies use, so that every draw of a run comes from its seed.
+    """
+
+    def __init__(self, seed=None, block=1024, key=None):
+        """Take the seed of the run, and how many variates to draw at a time."""
+        self.seed = seed
+        self.block = block
+        self.rng = np.random.default_rng(seed)
+
+        # Distribution -> [variates, position of the next one to hand out]
+        self.blocks = {}
+
+        self.key = uuid4().hex if key is None else key
+        streams[self.key] = self
+
+    def __reduce__(self):
+        # the key finds the live stream, and the generator's state (which is
+        # small) continues it elsewhere. Blocks are left out (see checkpoint)
+        state = self.rng.bit_generator.state
+
+        return (shared, (self.key, self.seed, state, self.block))
+
+    def checkpoint(self):
+        """
+        Pickle the stream as a stream of its own, rather than as this stream,
+        so that a run resumed from a checkpoint draws what this one would
+        have from that point on, even if this one is still going.
+        """
+        state = self.rng.bit_generator.state
+
+        return (restore, (self.seed, state, self.blocks, self.block))
+
+    def take(self, dist, n, draw):
+        """Get the next n variates of a distribution, drawing a block if needed."""
+        block = self.blocks.get(dist)
+
+        if block is None or block[1] + n > len(block[0]):
+            left = [] if block is None else block[0][block[1] :]
+            block = self.blocks[dist] = [
+                left + draw(max(self.block, n - len(left))).tolist(),
+                0,
+            ]
+
+        block[1] += n
+
+        return block[0][block[1] - n : block[1]]
+
+    def next(self, dist, draw):
+        """Get the next variate of a distribution."""
+        block = self.blocks.get(dist)
+
+        if block is None or block[1] == len(block[0]):
+            block = self.blocks[dist] = [draw(self.block).tolist(), 0]
+
+        block[1] += 1
+
+        return block[0][block[1] - 1]
+
+    def normal(self, mu=0.0, sigma=1.0, size=None):
+        """Like numpy.random.normal, but for scalar mu and sigma only."""
+        if size is None:
+            return mu + sigma * self.next("normal", self.rng.standard_normal)
+
+        return mu + sigma * np.array(
+            self.take("normal", size, self.rng.standard_normal)
+        )
+
+    def beta(self, a, b, size=None):
+        """Like numpy.random.beta, but for scalar a and b only."""
+        dist = ("beta", a, b)
+
+        if size is None:
+            return self.next(dist, lambda n: self.rng.beta(a, b, n))
+
+        return np.array(self.take(dist, size, lambda n: self.rng.beta(a, b, n)))
+
+    def random(self):
+        """Like random.random."""
+        return self.next("random", self.rng.random)
+
+    def randrange(self, start, stop=None):
+        """Like random.randrange, but without a step."""
+        if stop is None:
+            (start, stop) = (0, start)
+
+        return int(self.rng.integers(start, stop))
+
+    def shuffle(self, x):
+        """Like random.shuffle: shuffle a list in place."""
+        self.rng.shuffle(x)
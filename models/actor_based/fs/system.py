@@ -1,9 +1,10 @@
 """Implements counters for global variables, and stochastic processes."""
 from math import pow
-from numpy.random import beta, normal
-from random import randrange
-from actors.provider import Provider
-from actors.buyer import Buyer
+from itertools import islice
+from operator import itemgetter
+from functools import partial
+from actors.store import gather
+from actors.delta import Delta, apply
 
 
 def update_market_storage_price(
@@ -40,13 +41,14 @@ def update_market_gas_price(params, substep, state_history, prev_state, policy_i
     """
     (mu, sigma) = params.get("gas_price_dist", (0.1, 0.025))
 
-    return ("mkt_gprice", normal(mu, sigma))
+    return ("mkt_gprice", prev_state["rng"].normal(mu, sigma))
 
 
 def calc_market_vis_price(params, substep, state_history, prev_state):
     return {
         "mkt_vprice": prev_state["mkt_vprice"]
-        + prev_state["mkt_vprice"] * normal(*params.get("d_vis_per_block", (0, 0.025))),
+        + prev_state["mkt_vprice"]
+        * prev_state["rng"].normal(*params.get("d_vis_per_block", (0, 0.025))),
     }
 
 
@@ -72,30 +74,125 @@ def take_profit_for(kind, u, prev_state):
 def perform_random_transfers(params, substep, state_history, prev_state):
     """Schedule a transfer of some random amount of VIS between two random users."""
 
+    signal = {"providers": Delta(), "users": Delta()}
+
     if prev_state["timestep"] % params.get("random_transfer_rate", 5):
-        return {"providers": prev_state["providers"], "users": prev_state["users"]}
+        return signal
+
+    # Pick two users to subtract a balance form and add to. Providers come
+    # first, then users
+    n_providers = len(prev_state["providers"])
+    (sender, recipient) = [
+        prev_state["rng"].randrange(0, n_providers + len(prev_state["users"]))
+        for x in range(2)
+    ]
+
+    def find(i):
+        (kind, i) = ("providers", i) if i < n_providers else ("users", i - n_providers)
 
-    # Pick two users to subtract a balance form and add to
-    all_users = [*prev_state["providers"].values(), *prev_state["users"].values()]
-    (sender, recipient) = [randrange(0, len(all_users)) for x in range(2)]
+        return (kind, next(islice(prev_state[kind].keys(), i, None)))
+
+    (sender, recipient) = (find(sender), find(recipient))
+    balances = {
+        (kind, id): prev_state[kind][id].balance for (kind, id) in (sender, recipient)
+    }
 
     # Generate an amount to send
     amt = (
-        beta(*params.get("profit_taking_amt_dist", [1, 5])) * all_users[sender].balance
+        prev_state["rng"].beta(*params.get("profit_taking_amt_dist", [1, 5]))
+        * balances[sender]
     )
 
-    all_users[sender].balance -= amt
-    all_users[recipient].balance += amt
+    balances[sender] -= amt
+    balances[recipient] += amt
 
-    return {
-        "providers": {u.id: u for u in all_users if isinstance(u, Provider)},
-        "users": {u.id: u for u in all_users if isinstance(u, Buyer)},
-    }
+    for ((kind, id), balance) in balances.items():
+        signal[kind].modify(id, balance=balance)
+
+    return signal
 
 
 def register_transfers_prov(params, substep, state_history, prev_state, policy_input):
-    return ("providers", policy_input["providers"])
+    return ("providers", apply(prev_state["providers"], policy_input["providers"]))
 
 
 def register_transfers_user(params, substep, state_history, prev_state, policy_input):
-    return ("users", policy_input["users"])
+    return ("users", apply(prev_state["users"], policy_input["users"]))
+
+
+def unmet_demand(state):
+    """Get how much storage was ordered beyond the capacity of all providers."""
+    (sizes,) = gather(state["orders"], "size")
+    (capacities,) = gather(state["providers"], "capacity")
+
+    return sizes.sum() - capacities.sum()
+
+
+def record_history(params, substep, state_history, prev_state, policy_input):
+    """Add this tick's aggregates to the history policies look back on."""
+    prev_state["history"].record(prev_state)
+
+    return ("history", prev_state["history"])
+
+
+def treasury_balance(state):
+    return state["providers"][state["treasury"]].balance
+
+
+def count(key, state):
+    return len(state[key])
+
+
+def total_balance(key, state):
+    """Get the VIS held by all of a dict or store of actors in the state."""
+    (balances,) = gather(state[key], "balance")
+
+    return balances.sum()
+
+
+def total_capacity(state):
+    (capacities,) = gather(state["providers"], "capacity")
+
+    return capacities.sum()
+
+
+def used_capacity(state):
+    (used,) = gather(state["providers"], "used")
+
+    return used.sum()
+
+
+# The metrics plotted in analysis.org, as functions of the state after a tick
+# (see sink.MetricsSink). They can all be pickled, so they can be sent to the
+# workers of a sweep
+metrics = {
+    "mkt_sprice": itemgetter("mkt_sprice"),
+    "mkt_vprice": itemgetter("mkt_vprice"),
+    "storage_stolen": itemgetter("storage_stolen"),
+    "v_slashed": itemgetter("v_slashed"),
+    "v_burned": itemgetter("v_burned"),
+    "n_providers": partial(count, "providers"),
+    "n_users": partial(count, "users"),
+    "n_unfilled_orders": partial(count, "orders"),
+    "n_active_orders": partial(count, "active"),
+    "n_challenges": partial(count, "challenges"),
+    "treasury": treasury_balance,
+    "providers_balance": partial(total_balance, "providers"),
+    "users_balance": partial(total_balance, "users"),
+    "total_capacity": total_capacity,
+    "used_capacity": used_capacity,
+    "unmet_demand": unmet_demand,
+}
+
+# The sizes of the collections policies work through, recorded at the start of
+# every tick when profiling (see profiler.instrument)
+sizes = {
+    name: metrics[name]
+    for name in (
+        "n_providers",
+        "n_users",
+        "n_unfilled_orders",
+        "n_active_orders",
+        "n_challenges",
+    )
+}
@@ -0,0 +1,144 @@
+"""Times the policies and state update functions of a model, tick by tick."""
+from time import perf_counter
+import numpy as np
+
+
+class Profile:
+    """
+    Wall time spent in, and calls to, each policy and state update function of
+    a model, per tick, and the sizes of the state (e.g., how many orders there
+    are) at the start of each tick.
+
+    Functions are named after the block they are in (by index), and their key
+    in it, e.g., "11 negotiate_orders" or "11 orders <- remove_fulfilled_orders".
+    """
+
+    def __init__(self, names, sizes):
+        self.names = names
+        self.sizes = sizes
+
+        # Per tick: seconds spent in each function, calls to each function, and
+        # the sizes of the state
+        self.times = []
+        self.calls = []
+        self.counts = []
+
+    def reset(self):
+        """Forget everything recorded so far (e.g., while warming up)."""
+        self.times.clear()
+        self.calls.clear()
+        self.counts.clear()
+
+    def tick(self, state):
+        """Start a new tick, with the state it starts from."""
+        self.times.append([0.0] * len(self.names))
+        self.calls.append([0] * len(self.names))
+        self.counts.append([size(state) for size in self.sizes.values()])
+
+    def timeline(self):
+        """
+        Get, per function and size, its value at every tick, as a dict of
+        arrays (e.g., for a pandas DataFrame). Functions' calls are under their
+        name followed by " calls".
+        """
+        times = np.array(self.times).reshape(-1, len(self.names))
+        calls = np.array(self.calls, dtype=np.int64).reshape(-1, len(self.names))
+        counts = np.array(self.counts).reshape(-1, len(self.sizes))
+
+        return {
+            "tick": np.arange(1, len(self.times) + 1),
+            **{name: counts[:, i] for (i, name) in enumerate(self.sizes)},
+            **{name: times[:, i] for (i, name) in enumerate(self.names)},
+            **{f"{name} calls": calls[:, i] for (i, name) in enumerate(self.names)},
+        }
+
+    def summary(self):
+        """
+        Get (function, calls, total seconds, mean seconds per call, share of
+        all time spent) for each function, slowest first.
+        """
+        # Totals over the whole run, from the per tick timeline
+        timeline = self.timeline()
+        totals = [
+            (name, timeline[f"{name} calls"].sum().item(), timeline[name].sum().item())
+            for name in self.names
+        ]
+        total = sum(spent for (_, _, spent) in totals) or 1.0
+
+        return sorted(
+            (
+                (name, calls, spent, spent / max(calls, 1), spent / total)
+                for (name, calls, spent) in totals
+            ),
+            key=lambda row: row[2],
+            reverse=True,
+        )
+
+    def table(self):
+        """Format the summary as a plain text table."""
+        width = max(len(name) for name in ["function", *self.names])
+        lines = [
+            f"{'function':<{width}} {'calls':>8} {'total (s)':>10} "
+            f"{'mean (ms)':>10} {'share':>7}"
+        ]
+
+        for (name, calls, total, mean, share) in self.summary():
+            lines.append(
+                f"{name:<{width}} {calls:>8} {total:>10.3f} "
+                f"{mean * 1000:>10.3f} {share:>7.1%}"
+            )
+
+        return "\n".join(lines)
+
+
+def timed(profile, i, f, starts_tick=False):
+    """Wrap a policy or state update function, to add its time to a profile."""
+    times = profile.times
+    calls = profile.calls
+
+    def wrapped(params, substep, state_history, prev_state, *args):
+        if starts_tick:
+            profile.tick(prev_state)
+
+        start = perf_counter()
+        result = f(params, substep, state_history, prev_state, *args)
+        times[-1][i] += perf_counter() - start
+        calls[-1][i] += 1
+
+        return result
+
+    wrapped.__name__ = f.__name__
+
+    return wrapped
+
+
+def instrument(state_update_blocks, sizes=None):
+    """
+    Get a copy of a model's state update blocks with every policy and state
+    update function timed, and the Profile they record to. sizes (name ->
+    function of the state) are recorded at the start of every tick.
+
+    Only the returned blocks are timed, so runs with the model's own blocks
+    pay nothing for profiling.
+    """
+    names = [
+        f"{i} {key}" if kind == "policies" else f"{i} {key} <- {f.__name__}"
+        for (i, block) in enumerate(state_update_blocks)
+        for kind in ("policies", "variables")
+        for (key, f) in block[kind].items()
+    ]
+    profile = Profile(names, sizes or {})
+    wrapped = []
+    j = 0
+
+    for block in state_update_blocks:
+        wrapped.append({**block})
+
+        for kind in ("policies", "variables"):
+            wrapped[-1][kind] = {}
+
+            for (key, f) in block[kind].items():
+                wrapped[-1][kind][key] = timed(profile, j, f, j == 0)
+                j += 1
+
+    return (wrapped, profile)
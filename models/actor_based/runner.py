@@ -0,0 +1,114 @@
+"""Runs Monte Carlo sweeps of a model across a pool of processes."""
+from itertools import islice
+from multiprocessing import get_context
+import importlib
+import os
+import random
+import sys
+import numpy as np
+from radcad.utils import generate_parameter_sweep
+from engine import steps
+from sink import MetricsSink
+
+# The model module each worker runs, imported once per worker
+model = None
+
+
+def load(model_dir):
+    """Import the model in the given directory, as its analysis.org would."""
+    global model
+
+    sys.path.insert(0, os.path.abspath(model_dir))
+    model = importlib.import_module("model")
+
+
+def run(task):
+    """
+    Run the model once, with one parameter set and one seed, and get what
+    metrics collected at every tick (or the final state, if there are none).
+    If an output directory is given, metrics are written there instead, and
+    the path of the run's directory is returned.
+    """
+    (i, params, seed, timesteps, metrics, out) = task
+
+    # Each run draws from its own streams, derived from the seed alone, so a
+    # run's results do not depend on the worker or the order it ran in
+    (py_seq, np_seq, rng_seq) = np.random.SeedSequence(seed).spawn(3)
+    random.seed(int(py_seq.generate_state(1)[0]))
+    np.random.seed(np_seq.generate_state(4))
+
+    initial_state = model.initial_state
+
+    # Models that keep a random stream in their state get a fresh one
+    if "rng" in initial_state:
+        initial_state = {
+            **initial_state,
+            "rng": type(initial_state["rng"])(rng_seq),
+        }
+
+    run = islice(steps(initial_state, model.state_update_blocks, params), timesteps)
+
+    if out is not None:
+        path = os.path.join(out, str(i))
+
+        with MetricsSink(path, metrics) as sink:
+            for state in run:
+                sink.write(state)
+
+        return (i, params, seed, path)
+
+    collected = {name: [] for name in metrics}
+    state = initial_state
+
+    # Only the latest state is kept around
+    for state in run:
+        for (name, metric) in metrics.items():
+            collected[name].append(metric(state))
+
+    return (i, params, seed, collected if len(metrics) > 0 else state)
+
+
+def sweep(
+    model_dir,
+    params,
+    seeds,
+    timesteps,
+    metrics=None,
+    processes=None,
+    chunksize=None,
+    out=None,
+):
+    """
+    Run a model with every parameter set of a radCAD-style sweep (a dict of
+    lists of values), and every seed, across a pool of processes.
+
+    Yields (index, parameter set, seed, results) as runs finish, where the
+    results are, per metric (a name -> function of the state, defined at the
+    top level of a module), its value at every tick, or the final state if no
+    metrics are given. Runs are handed to workers in chunks of chunksize.
+
+    If an output directory is given, each run writes its metrics to its own
+    directory in it (named after the run's index) a chunk at a time, and the
+    results are the paths to those (see sink.load).
+    """
+    tasks = [
+        (i, param_set, seed, timesteps, metrics or {}, out)
+        for (i, (param_set, seed)) in enumerate(
+            (param_set, seed)
+            for param_set in generate_parameter_sweep(params)
+            for seed in seeds
+        )
+    ]
+
+    processes = processes or os.cpu_count()
+
+    if chunksize is None:
+        (chunksize, extra) = divmod(len(tasks), processes * 4)
+        chunksize += bool(extra)
+
+    # Models are imported fresh in each worker, as both of them have an actors
+    # package, and so cannot share a process
+    with get_context("spawn").Pool(
+        processes, initializer=load, initargs=(model_dir,)
+    ) as pool:
+        yield from pool.imap_unordered(run, tasks, max(chunksize, 1))
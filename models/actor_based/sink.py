@@ -0,0 +1,145 @@
+"""Writes per-tick metrics of a run to columnar files, a chunk at a time."""
+import os
+import numpy as np
+
+# Parquet output is optional
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# Every .npy header is padded to this many bytes, so that it can be rewritten
+# in place with a longer shape as columns grow
+HEADER_SIZE = 128
+
+
+def npy_header(dtype, length):
+    """Get the header of a 1-D .npy file (format version 1.0)."""
+    header = repr(
+        {"descr": np.dtype(dtype).str, "fortran_order": False, "shape": (length,)}
+    )
+    header = header.ljust(HEADER_SIZE - 10 - 1) + "\n"
+
+    return (
+        b"\x93NUMPY\x01\x00"
+        + (HEADER_SIZE - 10).to_bytes(2, "little")
+        + header.encode("latin1")
+    )
+
+
+class MetricsSink:
+    """
+    Collects metrics (functions of the state, by name) after every tick into
+    preallocated column buffers, and appends them to files on disk once a
+    chunk of ticks has been collected.
+
+    With the "npy" format, each metric is a .npy file in the output directory,
+    and its header is kept up to date on every flush, so the columns can be
+    memory-mapped with numpy.load(..., mmap_mode="r") (see load) while the run
+    is still going. With the "parquet" format (which needs pyarrow), chunks
+    are row groups of a single metrics.parquet file.
+    """
+
+    def __init__(self, path, metrics, chunk=4096, format="npy"):
+        """
+        Take the directory to write to, the metrics (name -> function of the
+        state, returning a number), and how many ticks to buffer at a time.
+        """
+        if format not in ("npy", "parquet"):
+            raise ValueError(f"Unknown metrics format: {format}")
+
+        if format == "parquet" and pq is None:
+            raise ImportError("Writing metrics to parquet needs pyarrow")
+
+        os.makedirs(path, exist_ok=True)
+
+        self.path = path
+        self.metrics = metrics
+        self.chunk = chunk
+        self.format = format
+
+        self.buffers = {"timestep": np.zeros(chunk, dtype=np.int64)} | {
+            name: np.zeros(chunk, dtype=np.float64) for name in metrics
+        }
+
+        # Ticks in the buffers, and ticks written out
+        self.n = 0
+        self.written = 0
+        self.writer = None
+
+        if format == "npy":
+            for (name, buffer) in self.buffers.items():
+                with open(self.file(name), "wb") as f:
+                    f.write(npy_header(buffer.dtype, 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def file(self, name):
+        return os.path.join(self.path, f"{name}.npy")
+
+    def write(self, state):
+        """Collect the metrics of the state after a tick."""
+        self.buffers["timestep"][self.n] = state["timestep"]
+
+        for (name, metric) in self.metrics.items():
+            self.buffers[name][self.n] = metric(state)
+
+        self.n += 1
+
+        if self.n == self.chunk:
+            self.flush()
+
+    def flush(self):
+        """Write out the ticks collected so far."""
+        if self.n == 0:
+            return
+
+        if self.format == "npy":
+            for (name, buffer) in self.buffers.items():
+                with open(self.file(name), "r+b") as f:
+                    f.write(npy_header(buffer.dtype, self.written + self.n))
+                    f.seek(0, os.SEEK_END)
+                    f.write(buffer[: self.n].tobytes())
+        else:
+            table = pa.table(
+                {name: buffer[: self.n] for (name, buffer) in self.buffers.items()}
+            )
+
+            if self.writer is None:
+                self.writer = pq.ParquetWriter(
+                    os.path.join(self.path, "metrics.parquet"), table.schema
+                )
+
+            self.writer.write_table(table)
+
+        self.written += self.n
+        self.n = 0
+
+    def close(self):
+        self.flush()
+
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+def load(path):
+    """
+    Memory-map the metrics written to a directory, as a dict of name -> array
+    (or a pyarrow Table, for parquet output).
+    """
+    parquet = os.path.join(path, "metrics.parquet")
+
+    if os.path.exists(parquet):
+        return pq.read_table(parquet, memory_map=True)
+
+    return {
+        name[: -len(".npy")]: np.load(os.path.join(path, name), mmap_mode="r")
+        for name in sorted(os.listdir(path))
+        if name.endswith(".npy")
+    }
@@ -0,0 +1,98 @@
+"""Implements an index of users by balance, for picking vote enforcers."""
+from bisect import bisect_left
+from random import randrange
+import numpy as np
+
+
+class BalanceIndex:
+    """
+    Sorts users by balance, so that a random user who can afford to back a
+    claim against a vote (whose balance is at least the tokens voted with) can
+    be picked in O(log U), without listing every user who can. Also keeps the
+    users' suspicion and chance to lie as arrays, so that votes can be drawn
+    at once.
+
+    Balances do not change while votes are being cast, so the index is built
+    once per tick.
+    """
+
+    def __init__(self, users):
+        """Take the users, in the order they are listed in the state."""
+        self.users = users
+        self.ranked = sorted(users, key=lambda u: u.balance)
+        self.balances = [u.balance for u in self.ranked]
+
+        # user_id -> position in the state's list, and in the ranking
+        self.positions = {u.user_id: i for (i, u) in enumerate(users)}
+        self.ranks = {u.user_id: i for (i, u) in enumerate(self.ranked)}
+
+        self.ids = np.array([u.user_id for u in users], dtype=np.int64)
+        self.suspicion = np.array([u.suspicion for u in users], dtype=np.float64)
+        self.chance_to_lie = np.array(
+            [u.chance_to_lie for u in users], dtype=np.float64
+        )
+
+        # The same, by position in the ranking, and each user's rank by their
+        # position in the state's list
+        self.ranked_balances = np.array(self.balances, dtype=np.float64)
+        self.ranked_suspicion = np.array(
+            [u.suspicion for u in self.ranked], dtype=np.float64
+        )
+        self.rank_of = np.array(
+            [self.ranks[u.user_id] for u in users], dtype=np.int64
+        )
+
+    def __len__(self):
+        return len(self.users)
+
+    def pick(self, balance, excluding):
+        """
+        Get a random user, other than the excluded one, whose balance is at
+        least the given one, or None if there is no such user.
+        """
+        lo = bisect_left(self.balances, balance)
+        skip = self.ranks[excluding.user_id]
+        n = len(self.ranked) - lo - (skip >= lo)
+
+        if n <= 0:
+            return None
+
+        i = lo + randrange(n)
+
+        return self.ranked[i + (lo <= skip <= i)]
+
+    def pick_many(self, balances, excluding):
+        """
+        Like pick, for many balances at once, each excluding the user at the
+        same index of excluding (positions in the state's list). Gets the
+        picked users' ranks, or -1 where there is nobody to pick.
+        """
+        lo = np.searchsorted(self.ranked_balances, balances, side="left")
+        skip = self.rank_of[excluding]
+        n = len(self.ranked) - lo - (skip >= lo)
+
+        picked = lo + np.floor(np.random.random(len(lo)) * n).astype(np.int64)
+        picked += (lo <= skip) & (skip <= picked)
+        picked[n <= 0] = -1
+
+        return picked
+
+    def first(self, n, excluding):
+        """Get the first n users in the state's list, other than the excluded one."""
+        skip = self.positions[excluding.user_id]
+
+        if skip >= n:
+            return self.users[:n]
+
+        return self.users[:skip] + self.users[skip + 1 : n + 1]
+
+    def suspicions(self, n, excluding):
+        """Get the suspicion of each of the users first would get, as an array."""
+        skip = self.positions[excluding.user_id]
+
+        if skip >= n:
+            return self.suspicion[:n]
+
+        return np.concatenate(
+            (self.suspicion[:skip], self.suspicion[skip + 1 : n + 1])
+        )
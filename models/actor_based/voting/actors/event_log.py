@@ -0,0 +1,520 @@
+"""Implements an append-only log of voting events, stored as columns."""
+from multiprocessing.reduction import ForkingPickler
+from uuid import uuid4
+from weakref import WeakValueDictionary, finalize
+import os
+import numpy as np
+from actors.voting_events import Voting_event
+
+# One row per voting event. Users and proposals are kept by id, and the
+# jurors of each event as a slice [jurors_start, jurors_end) of its chunk's
+# jurors array
+EVENT = np.dtype(
+    [
+        ("tick", np.int64),
+        ("voter_id", np.int64),
+        ("proposal_id", np.int64),
+        # -1 if no enforcer claimed the vote was fraudulent
+        ("enforcer_id", np.int64),
+        # jurors who ruled on the claim, whether or not they were recorded
+        ("jury_size", np.int64),
+        ("jurors_start", np.int64),
+        ("jurors_end", np.int64),
+        ("jury_verdict_guilty", np.bool_),
+        ("real_result_guilty", np.bool_),
+        ("voter_tokens", np.float64),
+    ]
+)
+
+# Fields given for each event, as opposed to worked out by the log
+FIELDS = [
+    "voter_id",
+    "proposal_id",
+    "enforcer_id",
+    "jury_size",
+    "jury_verdict_guilty",
+    "real_result_guilty",
+    "voter_tokens",
+]
+
+
+class Events:
+    """
+    The voting events of one tick, as they are made, to be appended to an
+    EventLog all at once.
+
+    Events are added either one by one, or many (uncontested ones) at a time
+    as arrays, and keep the order they were added in.
+    """
+
+    def __init__(self):
+        # Arrays of each field, one per batch of events
+        self.batches = []
+
+        # Events added one by one since the last batch, as rows of FIELDS
+        self.rows = []
+
+        # Per event, the ids of the jurors recorded for it
+        self.jurors = []
+
+    def __len__(self):
+        return sum(len(batch["voter_id"]) for batch in self.batches) + len(self.rows)
+
+    def add(
+        self,
+        voter_id,
+        proposal_id,
+        real_result_guilty,
+        voter_tokens,
+        enforcer_id=-1,
+        jury_size=0,
+        jury_verdict_guilty=False,
+        jurors=(),
+    ):
+        """Add one event."""
+        self.rows.append(
+            (
+                voter_id,
+                proposal_id,
+                enforcer_id,
+                jury_size,
+                jury_verdict_guilty,
+                real_result_guilty,
+                voter_tokens,
+            )
+        )
+        self.jurors.append(jurors)
+
+    def add_many(self, voter_ids, proposal_ids, real_result_guilty, voter_tokens):
+        """Add many events that no enforcer claimed against, from arrays."""
+        self.flush()
+
+        n = len(voter_ids)
+        self.batches.append(
+            {
+                "voter_id": voter_ids,
+                "proposal_id": proposal_ids,
+                "enforcer_id": np.full(n, -1),
+                "jury_size": np.zeros(n, dtype=np.int64),
+                "jury_verdict_guilty": np.zeros(n, dtype=np.bool_),
+                "real_result_guilty": real_result_guilty,
+                "voter_tokens": voter_tokens,
+            }
+        )
+        self.jurors.extend([()] * n)
+
+    def flush(self):
+        """Turn the events added one by one so far into a batch."""
+        if len(self.rows) == 0:
+            return
+
+        self.batches.append(
+            {name: np.array(column) for (name, column) in zip(FIELDS, zip(*self.rows))}
+        )
+        self.rows = []
+
+    def arrays(self):
+        """
+        Get the events as a structured array of EVENT (with jurors offsets
+        from 0), and the ids of all of their jurors, one after the other.
+        """
+        self.flush()
+
+        events = np.zeros(len(self), dtype=EVENT)
+        start = 0
+
+        for batch in self.batches:
+            end = start + len(batch["voter_id"])
+
+            for name in FIELDS:
+                events[name][start:end] = batch[name]
+
+            start = end
+
+        counts = np.fromiter(
+            (len(jurors) for jurors in self.jurors), np.int64, len(self.jurors)
+        )
+        events["jurors_end"] = np.cumsum(counts)
+        events["jurors_start"] = events["jurors_end"] - counts
+
+        jurors = np.fromiter(
+            (juror for jurors in self.jurors for juror in jurors),
+            np.int64,
+            int(counts.sum()),
+        )
+
+        return (events, jurors)
+
+
+# The full chunks of the logs in this process, by key. radCAD hands every
+# policy and state update function a pickled copy of the state, and this lets
+# every copy of a log share the chunks, rather than pickle them over again
+live = WeakValueDictionary()
+
+# Per chunk this process spilled, how many lists of full chunks hold it. Chunks
+# no list holds any more are deleted, unless a log was checkpointed with them
+held = {}
+kept = set()
+
+
+class Chunks(list):
+    """
+    The full chunks of a log, which its copies share. Chunks spilled by this
+    process count as held by the list until it is collected.
+    """
+
+    def __init__(self, full=(), path=None):
+        super().__init__(full)
+
+        # The spilled chunks the list holds
+        self.names = [] if path is None else [name for name in self if name in held]
+
+        for name in self.names:
+            held[name] += 1
+
+        if path is not None:
+            finalize(self, release, os.getpid(), path, self.names)
+
+    def spill(self, name):
+        """Add a chunk this process just spilled."""
+        held[name] = held.get(name, 0) + 1
+        self.names.append(name)
+        self.append(name)
+
+
+def release(pid, path, names):
+    """
+    Let go of the spilled chunks a list held, deleting the ones no other list
+    holds. Lists copied into a forked process leave the chunks to the parent.
+    """
+    if os.getpid() != pid:
+        return
+
+    for name in names:
+        held[name] -= 1
+
+        if held[name] > 0:
+            continue
+
+        del held[name]
+
+        if name in kept:
+            continue
+
+        for part in ("events", "jurors"):
+            try:
+                os.remove(os.path.join(path, f"{name}-{part}.npy"))
+            except FileNotFoundError:
+                pass
+
+
+def restore(full, path, chunk, events, jurors, totals):
+    """Make a log that picks up where another one was, from its full chunks."""
+    log = EventLog(path, chunk)
+    log.own(full)
+    log.n_full = len(full)
+
+    log.events[: len(events)] = events
+    log.jurors = np.zeros(max(chunk, len(jurors)), dtype=np.int64)
+    log.jurors[: len(jurors)] = jurors
+    (log.n, log.n_jurors) = (len(events), len(jurors))
+    log.totals = totals
+
+    return log
+
+
+def shared(key, n_full, spilled, *state):
+    """
+    Get a copy of a log, with the live full chunks under its key, or, in a
+    process they are not live in, the ones it spilled (given by name).
+    """
+    chunks = live.get(key)
+
+    if chunks is not None and len(chunks) >= n_full:
+        log = restore([], *state)
+        (log.key, log.chunks, log.n_full) = (key, chunks, n_full)
+
+        return log
+
+    if spilled is not None:
+        path = state[0]
+
+        if not all(
+            os.path.exists(os.path.join(path, f"{name}-events.npy"))
+            for name in spilled
+        ):
+            raise RuntimeError(
+                "The spilled chunks of this event log were deleted along with "
+                "every copy of it. Send it with EventLog.checkpoint to keep them"
+            )
+
+        return restore(spilled, *state)
+
+    if n_full > 0:
+        raise RuntimeError(
+            "The full chunks of this event log are in another process. Send "
+            "it with EventLog.checkpoint, or give it a directory to spill to"
+        )
+
+    return restore([], *state)
+
+
+class EventLog:
+    """
+    Every voting event of a run, in the order they happened, by id (their
+    position in the log).
+
+    Events are appended to fixed-size chunks of rows. Full chunks never change
+    again, so copies of the log share them: a pickled log (e.g., the copies
+    radCAD makes of the state every substep) only carries the chunk being
+    filled, and finds its full chunks again by key in the process it was
+    pickled in. Given a directory, full chunks are spilled to it as .npy
+    files, under names of their own, and memory-mapped back when read, so
+    memory does not grow with the length of a run either. Spilled files are
+    deleted once no copy of the log in the process that spilled them holds
+    them, unless the log was checkpointed, which leaves them to whoever reads
+    the checkpoint.
+
+    Running totals of verdicts are kept as events are appended, so the rates
+    that the analysis plots every tick take O(1) to look up.
+    """
+
+    def __init__(self, path=None, chunk=4096):
+        """
+        Take the directory to spill full chunks to (None keeps them in memory),
+        and how many events go in a chunk.
+        """
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+        self.path = path
+        self.chunk = chunk
+
+        # Full chunks, as (events, jurors) arrays, or the names of the files
+        # they were spilled to. The list is shared with copies of the log, so
+        # only the first n_full are this log's
+        self.own([])
+        self.n_full = 0
+
+        # The chunk being filled, and how many of its rows and jurors are used
+        self.events = np.zeros(chunk, dtype=EVENT)
+        self.jurors = np.zeros(chunk, dtype=np.int64)
+        self.n = 0
+        self.n_jurors = 0
+
+        self.totals = {
+            "guilty": 0,
+            "falsely_guilty": 0,
+            "falsely_innocent": 0,
+            "contested": 0,
+            "jurors": 0,
+            "voter_tokens": 0.0,
+        }
+
+    def __len__(self):
+        return self.n_full * self.chunk + self.n
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def __getitem__(self, i):
+        """Get an event by id, as a Voting_event."""
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+
+        (events, jurors) = self.read(i // self.chunk)
+        row = events[i % self.chunk]
+
+        event = Voting_event()
+        event.voting_event_id = i
+        event.tick = int(row["tick"])
+        event.voter_id = int(row["voter_id"])
+        event.proposal_id = int(row["proposal_id"])
+        event.enforcer_id = int(row["enforcer_id"])
+        event.jury_size = int(row["jury_size"])
+        event.jury = jurors[row["jurors_start"] : row["jurors_end"]].tolist()
+        event.jury_verdict_guilty = bool(row["jury_verdict_guilty"])
+        event.real_result_guilty = bool(row["real_result_guilty"])
+        event.voter_tokens = float(row["voter_tokens"])
+
+        return event
+
+    def __reduce__(self):
+        # full chunks are found by key, but spilled ones' names are small
+        # enough to take along, to be read in any process
+        return (
+            shared,
+            (
+                self.key,
+                self.n_full,
+                None if self.path is None else self.chunks[: self.n_full],
+                *self.state(),
+            ),
+        )
+
+    def checkpoint(self):
+        """
+        Pickle the log with its full chunks, as a log of its own, so that it
+        can be read in another process (e.g., at the end of a run in a pool
+        of workers, or resumed from a checkpoint). Its spilled files are kept
+        from then on.
+        """
+        if self.path is not None:
+            kept.update(self.chunks[: self.n_full])
+
+        return (restore, (self.chunks[: self.n_full], *self.state()))
+
+    def own(self, full):
+        """
+        Keep the given full chunks in a list of the log's own, under a new key
+        (along with the process it lives in, which alone adds to it).
+        """
+        self.key = (os.getpid(), uuid4().hex)
+        self.chunks = live[self.key] = Chunks(full, self.path)
+
+    def state(self):
+        """Get what a copy of the log needs besides its full chunks."""
+        return (
+            self.path,
+            self.chunk,
+            self.events[: self.n],
+            self.jurors[: self.n_jurors],
+            dict(self.totals),
+        )
+
+    def read(self, k):
+        """Get the events and jurors of chunk k (memory-mapped if spilled)."""
+        if k == self.n_full:
+            return (self.events[: self.n], self.jurors[: self.n_jurors])
+
+        if self.path is None:
+            return self.chunks[k]
+
+        name = os.path.join(self.path, self.chunks[k])
+
+        return (
+            np.load(f"{name}-events.npy", mmap_mode="r"),
+            np.load(f"{name}-jurors.npy", mmap_mode="r"),
+        )
+
+    def append(self, events: Events, tick):
+        """Add the events of a tick."""
+        (rows, jurors) = events.arrays()
+        rows["tick"] = tick
+
+        self.count(rows)
+
+        while len(rows) > 0:
+            take = min(self.chunk - self.n, len(rows))
+            (first, last) = (rows["jurors_start"][0], rows["jurors_end"][take - 1])
+
+            if self.n_jurors + last - first > len(self.jurors):
+                self.jurors = np.resize(
+                    self.jurors, max(2 * len(self.jurors), self.n_jurors + last - first)
+                )
+
+            self.events[self.n : self.n + take] = rows[:take]
+            self.events["jurors_start"][self.n : self.n + take] += self.n_jurors - first
+            self.events["jurors_end"][self.n : self.n + take] += self.n_jurors - first
+            self.jurors[self.n_jurors : self.n_jurors + last - first] = jurors[
+                first:last
+            ]
+
+            self.n += take
+            self.n_jurors += last - first
+            rows = rows[take:]
+
+            if self.n == self.chunk:
+                self.seal()
+
+    def seal(self):
+        """Close the full chunk, spilling it if there is a directory to."""
+        (events, jurors) = (self.events, self.jurors[: self.n_jurors].copy())
+
+        # Another copy of the log already added chunks of its own past this
+        # log's, or the log was copied into another process (e.g., forked),
+        # so this one goes on from a list of its own
+        if len(self.chunks) > self.n_full or self.key[0] != os.getpid():
+            self.own(self.chunks[: self.n_full])
+
+        if self.path is None:
+            events.flags.writeable = False
+            jurors.flags.writeable = False
+            self.chunks.append((events, jurors))
+        else:
+            # every run, and every copy, spills to files of its own
+            name = uuid4().hex
+            np.save(os.path.join(self.path, f"{name}-events.npy"), events)
+            np.save(os.path.join(self.path, f"{name}-jurors.npy"), jurors)
+            self.chunks.spill(name)
+
+        self.n_full += 1
+
+        self.events = np.zeros(self.chunk, dtype=EVENT)
+        self.jurors = np.zeros(self.chunk, dtype=np.int64)
+        self.n = 0
+        self.n_jurors = 0
+
+    def count(self, rows):
+        """Add events to the running totals."""
+        guilty = rows["jury_verdict_guilty"]
+        real = rows["real_result_guilty"]
+        contested = rows["enforcer_id"] >= 0
+
+        self.totals["guilty"] += int(np.count_nonzero(guilty))
+        self.totals["falsely_guilty"] += int(np.count_nonzero(guilty & ~real))
+        self.totals["falsely_innocent"] += int(np.count_nonzero(~guilty & real))
+        self.totals["contested"] += int(np.count_nonzero(contested))
+        self.totals["jurors"] += int(rows["jury_size"].sum())
+        self.totals["voter_tokens"] += float(rows["voter_tokens"].sum())
+
+    def column(self, name):
+        """Get a field of every event, as one array."""
+        return np.concatenate(
+            [self.read(k)[0][name] for k in range(self.n_full + 1)]
+        )
+
+    def guilty_rate(self):
+        """Get the share of all events the voter was found guilty in."""
+        return self.totals["guilty"] / len(self) if len(self) else 0
+
+    def false_rates(self):
+        """
+        Get the share of guilty verdicts that were wrong, and of innocent ones
+        (including votes no enforcer claimed against) that were wrong.
+        """
+        innocent = len(self) - self.totals["guilty"]
+
+        return (
+            self.totals["falsely_guilty"] / self.totals["guilty"]
+            if self.totals["guilty"]
+            else 0,
+            self.totals["falsely_innocent"] / innocent if innocent else 0,
+        )
+
+    def mean_jury_size(self):
+        """Get the average number of jurors ruling on a contested vote."""
+        return (
+            self.totals["jurors"] / self.totals["contested"]
+            if self.totals["contested"]
+            else 0
+        )
+
+    def jury_sizes(self):
+        """Get the number of jurors ruling on each contested vote, as an array."""
+        sizes = self.column("jury_size")
+
+        return sizes[self.column("enforcer_id") >= 0]
+
+
+# Logs sent to other processes (by runner.py, or radCAD's process pools) take
+# their full chunks along
+ForkingPickler.register(EventLog, EventLog.checkpoint)
+
+# radCAD's default backend sends them with pathos' fork of multiprocessing
+try:
+    from multiprocess.reduction import ForkingPickler as PathosPickler
+
+    PathosPickler.register(EventLog, EventLog.checkpoint)
+except ImportError:
+    pass
@@ -7,7 +7,8 @@ class Idea:
     """
     Represents an idea.
 
-    Supports the creation of proposals and selling of its tokens.
+    Supports the creation of proposals and selling of its tokens. Its treasury,
+    and who holds its tokens, are kept in the TokenLedger.
     """
 
     # The total amount of the idea's token in circulation
@@ -17,17 +18,9 @@ class Idea:
     # Unique id for the idea's token
     idea_id: int
 
-    # The amount of tokens owned by the idea and not shareholders
-    treasury: float
-
-    # Set of all users by user_id
-    shareholders: {}
-
     def __init__(self, volume, idea_id):
         """Take the volume of the idea's token, and the token ID."""
         self.volume = volume
-        self.treasury = volume
-        self.shareholders = set()
         self.idea_id = idea_id
 
     def __hash__(self):
@@ -39,29 +32,16 @@ class Idea:
         return self.idea_id == o.idea_id
 
 
-def generate_ideas(params, substep, state_history, prev_state, policy_input):
-    """Add a new user every 45 ticks."""
-    prev_ideas = prev_state["ideas"]
-
+def generate_ideas(params, substep, state_history, prev_state):
+    """Make a new idea every some params["ticks_per_idea"] ticks."""
     if prev_state["timestep"] % params["ticks_per_idea"] != 0:
-        return ("ideas", prev_ideas)
-
-    return (
-        "ideas",
-        [*prev_ideas, Idea(params["idea_token_volume"], len(prev_ideas))],
-    )
+        return {"ideas": []}
 
+    return {"ideas": [Idea(params["idea_token_volume"], len(prev_state["ideas"]))]}
 
-def process_token_sell(params, substep, state_history, prev_state, policy_input):
-    """Process the token sell on the ideas' side."""
-    idea: Idea
-    for idea in prev_state["ideas"]:
-        if idea.idea_id in policy_input["idea_treasury"]:
-            idea.treasury = policy_input["idea_treasury"][idea.idea_id]
 
-        if idea.idea_id in policy_input["idea_new_shareholders"]:
-            idea.shareholders.update(
-                policy_input["idea_new_shareholders"][idea.idea_id]
-            )
+def add_ideas(params, substep, state_history, prev_state, policy_input):
+    """Add the ideas made in the substep."""
+    prev_state["ideas"].extend(policy_input["ideas"])
 
     return ("ideas", prev_state["ideas"])
@@ -0,0 +1,315 @@
+"""Implements a ledger of every idea token in the model."""
+import numpy as np
+
+# Holdings are keyed by user_id * KEY + idea_id
+KEY = 2**32
+
+
+def grown(array, n):
+    """Get an array with room for at least n entries, zero-filled past its end."""
+    if n <= len(array):
+        return array
+
+    bigger = np.zeros(max(n, 2 * len(array)), dtype=array.dtype)
+    bigger[: len(array)] = array
+
+    return bigger
+
+
+class TokenLedger:
+    """
+    Keeps every idea token in the model: each idea's treasury (the tokens it
+    has not sold yet), what each user holds of each idea, and what each user
+    froze in each open proposal.
+
+    Holdings are sparse: there is one entry per (user, idea) pair the user has
+    ever bought tokens of, stored as arrays of user ids, idea ids and amounts
+    (COO). The entries are also indexed in order of user, then idea, so that a
+    user's holdings are a slice of that index, and, rebuilt only when new pairs
+    show up, grouped by idea (CSR), so that an idea's holders are a slice too.
+
+    Transfers are applied a batch at a time (a tick's buys, or its freezes and
+    slashes), and how much each user and idea holds in total is kept up to
+    date as they are, so that circulation and net worth take O(1) to look up.
+    """
+
+    def __init__(self):
+        # idea_id -> tokens not sold yet
+        self.treasury = np.zeros(0, dtype=np.float64)
+
+        # Holdings, in the order they were first bought
+        self.users = np.zeros(16, dtype=np.int64)
+        self.ideas = np.zeros(16, dtype=np.int64)
+        self.amounts = np.zeros(16, dtype=np.float64)
+        self.n = 0
+
+        # Holdings' keys in sorted order, and where each of them is
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.order = np.zeros(0, dtype=np.int64)
+
+        # Holdings grouped by idea: idea i's are by_idea[idea_ptr[i]:idea_ptr[i + 1]]
+        self.by_idea = np.zeros(0, dtype=np.int64)
+        self.idea_ptr = np.zeros(1, dtype=np.int64)
+        self.stale = False
+
+        # Totals held, and frozen, by user_id and by idea_id
+        self.user_held = np.zeros(0, dtype=np.float64)
+        self.user_frozen = np.zeros(0, dtype=np.float64)
+        self.idea_held = np.zeros(0, dtype=np.float64)
+        self.idea_frozen = np.zeros(0, dtype=np.float64)
+
+        # proposal_id -> (idea_id, [user ids], [amounts]), a pair of arrays
+        # per tick tokens were frozen in it
+        self.frozen = {}
+
+    def __len__(self):
+        return self.n
+
+    def fit(self, n_users, n_ideas):
+        """Make room for users and ideas with ids below the given ones."""
+        self.user_held = grown(self.user_held, n_users)
+        self.user_frozen = grown(self.user_frozen, n_users)
+        self.treasury = grown(self.treasury, n_ideas)
+        self.idea_held = grown(self.idea_held, n_ideas)
+        self.idea_frozen = grown(self.idea_frozen, n_ideas)
+
+    def find(self, user_ids, idea_ids):
+        """Get the entries of (user, idea) pairs, or -1 for ones with none."""
+        keys = user_ids * KEY + idea_ids
+
+        if len(self.keys) == 0:
+            return np.full(len(keys), -1)
+
+        # searchsorted is much faster on sorted keys, which buys come in
+        if np.any(keys[1:] < keys[:-1]):
+            by_key = np.argsort(keys)
+            i = np.empty(len(keys), dtype=np.int64)
+            i[by_key] = np.searchsorted(self.keys, keys[by_key])
+        else:
+            i = np.searchsorted(self.keys, keys)
+
+        found = i < len(self.keys)
+        found[found] = self.keys[i[found]] == keys[found]
+
+        return np.where(found, self.order[np.minimum(i, len(self.keys) - 1)], -1)
+
+    def entries(self, user_ids, idea_ids):
+        """Get the entries of (user, idea) pairs, adding ones that are new."""
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        idea_ids = np.asarray(idea_ids, dtype=np.int64)
+        found = self.find(user_ids, idea_ids)
+        new = found < 0
+
+        if not new.any():
+            return found
+
+        (keys, first, inverse) = np.unique(
+            user_ids[new] * KEY + idea_ids[new], return_index=True, return_inverse=True
+        )
+        entries = np.arange(self.n, self.n + len(keys))
+
+        self.users = grown(self.users, self.n + len(keys))
+        self.ideas = grown(self.ideas, self.n + len(keys))
+        self.amounts = grown(self.amounts, self.n + len(keys))
+        self.users[entries] = user_ids[new][first]
+        self.ideas[entries] = idea_ids[new][first]
+        self.n += len(keys)
+
+        # the new keys are sorted already, so they are merged in, not sorted
+        at = np.searchsorted(self.keys, keys)
+        self.keys = np.insert(self.keys, at, keys)
+        self.order = np.insert(self.order, at, entries)
+        self.stale = True
+
+        found[new] = entries[inverse]
+
+        return found
+
+    def mint(self, idea_ids, volumes):
+        """Put the tokens of new ideas in their treasuries."""
+        idea_ids = np.asarray(idea_ids, dtype=np.int64)
+
+        self.fit(len(self.user_held), idea_ids.max(initial=-1) + 1)
+        np.add.at(self.treasury, idea_ids, volumes)
+
+    def buy(self, user_ids, idea_ids, amounts):
+        """Move tokens bought from the ideas' treasuries to the users buying them."""
+        (user_ids, idea_ids, amounts) = (
+            np.asarray(user_ids, dtype=np.int64),
+            np.asarray(idea_ids, dtype=np.int64),
+            np.asarray(amounts, dtype=np.float64),
+        )
+        self.fit(user_ids.max(initial=-1) + 1, 0)
+        entries = self.entries(user_ids, idea_ids)
+
+        # sums by index with bincount, which is much faster than np.add.at
+        self.amounts[: self.n] += np.bincount(entries, amounts, minlength=self.n)
+        self.user_held += np.bincount(
+            user_ids, amounts, minlength=len(self.user_held)
+        )
+
+        by_idea = np.bincount(idea_ids, amounts, minlength=len(self.treasury))
+        self.treasury -= by_idea
+        self.idea_held += by_idea
+
+    def vote(self, freezes, slashes):
+        """
+        Take the tokens users voted with, in one pass: freeze the ones voted
+        with in proposals (user ids, proposal ids, idea ids, amounts), until
+        the proposals close, and burn the ones of votes found fraudulent (user
+        ids, idea ids, amounts).
+
+        Holdings never go below 0 (which they might, by floating point
+        rounding), but the whole amount voted with is frozen.
+        """
+        (user_ids, proposal_ids, idea_ids, amounts) = (
+            np.asarray(column, dtype=dtype)
+            for (column, dtype) in zip(freezes, [np.int64] * 3 + [np.float64])
+        )
+        (slashed_ids, slashed_ideas, slashed) = (
+            np.asarray(column, dtype=dtype)
+            for (column, dtype) in zip(slashes, [np.int64] * 2 + [np.float64])
+        )
+
+        entries = self.find(
+            np.concatenate((user_ids, slashed_ids)),
+            np.concatenate((idea_ids, slashed_ideas)),
+        )
+        (entries, at) = np.unique(entries, return_inverse=True)
+        taken = np.minimum(
+            np.bincount(at, weights=np.concatenate((amounts, slashed))),
+            self.amounts[entries],
+        )
+
+        self.amounts[entries] -= taken
+        np.subtract.at(self.user_held, self.users[entries], taken)
+        np.subtract.at(self.idea_held, self.ideas[entries], taken)
+
+        if len(amounts) == 0:
+            return
+
+        np.add.at(self.user_frozen, user_ids, amounts)
+        np.add.at(self.idea_frozen, idea_ids, amounts)
+
+        # group the freezes by proposal
+        order = np.argsort(proposal_ids, kind="stable")
+        (proposals, starts) = np.unique(proposal_ids[order], return_index=True)
+
+        for (proposal_id, idea_id, start, end) in zip(
+            proposals.tolist(),
+            idea_ids[order][starts].tolist(),
+            starts.tolist(),
+            [*starts[1:].tolist(), len(order)],
+        ):
+            (_, frozen_ids, frozen) = self.frozen.setdefault(
+                proposal_id, (idea_id, [], [])
+            )
+            frozen_ids.append(user_ids[order[start:end]])
+            frozen.append(amounts[order[start:end]])
+
+    def close(self, proposal_id, passed):
+        """
+        Let go of the tokens frozen in a proposal that closed: they go back to
+        their users if it passed, and are gone otherwise.
+        """
+        if proposal_id not in self.frozen:
+            return
+
+        (idea_id, user_ids, amounts) = self.frozen.pop(proposal_id)
+        (user_ids, amounts) = (np.concatenate(user_ids), np.concatenate(amounts))
+
+        np.subtract.at(self.user_frozen, user_ids, amounts)
+        self.idea_frozen[idea_id] -= amounts.sum()
+
+        if passed:
+            np.add.at(
+                self.amounts,
+                self.find(user_ids, np.full(len(user_ids), idea_id)),
+                amounts,
+            )
+            np.add.at(self.user_held, user_ids, amounts)
+            self.idea_held[idea_id] += amounts.sum()
+
+    def holding(self, user_id, idea_id):
+        """Get how many tokens of an idea a user holds."""
+        entry = self.find(np.array([user_id]), np.array([idea_id]))[0]
+
+        return self.amounts[entry].item() if entry >= 0 else 0
+
+    def of(self, user_id):
+        """Get the ids of the ideas a user holds tokens of, and how many of them."""
+        (lo, hi) = np.searchsorted(self.keys, [user_id * KEY, (user_id + 1) * KEY])
+        entries = self.order[lo:hi]
+
+        return (self.ideas[entries], self.amounts[entries])
+
+    def holders(self, idea_id):
+        """Get the ids of the users holding an idea's tokens, and how many of them."""
+        if self.stale:
+            self.by_idea = np.lexsort((self.users[: self.n], self.ideas[: self.n]))
+            self.idea_ptr = np.searchsorted(
+                self.ideas[self.by_idea], np.arange(len(self.treasury) + 1)
+            )
+            self.stale = False
+
+        if idea_id + 1 >= len(self.idea_ptr):
+            return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64))
+
+        entries = self.by_idea[self.idea_ptr[idea_id] : self.idea_ptr[idea_id + 1]]
+
+        return (self.users[entries], self.amounts[entries])
+
+    def circulation(self, idea_id):
+        """Get how many of an idea's tokens users hold, frozen or not."""
+        return (self.idea_held[idea_id] + self.idea_frozen[idea_id]).item()
+
+    def net_worth(self, user):
+        """Get a user's balance plus the tokens they hold, frozen or not."""
+        if user.user_id >= len(self.user_held):
+            return user.balance
+
+        return (
+            user.balance
+            + self.user_held[user.user_id]
+            + self.user_frozen[user.user_id]
+        ).item()
+
+
+def mint_tokens(params, substep, state_history, prev_state, policy_input):
+    """Put the tokens of the ideas made in the substep in their treasuries."""
+    if len(policy_input["ideas"]) == 0:
+        return ("ledger", prev_state["ledger"])
+
+    prev_state["ledger"].mint(
+        [idea.idea_id for idea in policy_input["ideas"]],
+        [idea.volume for idea in policy_input["ideas"]],
+    )
+
+    return ("ledger", prev_state["ledger"])
+
+
+def process_token_sell(params, substep, state_history, prev_state, policy_input):
+    """Process the token buys on the ideas' side, all at once."""
+    prev_state["ledger"].buy(*policy_input["token_buys"])
+
+    return ("ledger", prev_state["ledger"])
+
+
+def process_vote_output(params, substep, state_history, prev_state, policy_input):
+    """Freeze the tokens used for proposal votes, and burn those found fraudulent."""
+    prev_state["ledger"].vote(
+        policy_input["frozen_tokens"], policy_input["lost_tokens"]
+    )
+
+    return ("ledger", prev_state["ledger"])
+
+
+def unfreeze_tokens(params, substep, state_history, prev_state, policy_input):
+    """
+    Unfreeze tokens if a proposal is finished: they are given back if the
+    proposal passed.
+    """
+    for (proposal_id, passed) in policy_input["closed_proposals"].items():
+        prev_state["ledger"].close(proposal_id, passed)
+
+    return ("ledger", prev_state["ledger"])
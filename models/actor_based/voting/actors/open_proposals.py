@@ -0,0 +1,49 @@
+"""Implements an index of the proposals still open to votes."""
+
+
+class OpenProposals:
+    """
+    Indexes open proposals (ones whose end_time has not come yet) by the idea
+    they concern, and by the tick they close at, so that users only look at
+    open proposals on ideas they hold, and closing proposals only looks at
+    the ones closing.
+
+    Only the ids of proposals are kept, as those never change.
+    """
+
+    def __init__(self, proposals=()):
+        # idea_id -> the ids of its open proposals, in the order they were made
+        self.ideas = {}
+
+        # end_time -> (idea_id, proposal_id) for each proposal closing then
+        self.closing = {}
+
+        for proposal in proposals:
+            if proposal.is_passed is None:
+                self.add(proposal)
+
+    def __len__(self):
+        return sum(len(proposals) for proposals in self.ideas.values())
+
+    def add(self, proposal):
+        """Open a newly made proposal."""
+        self.ideas.setdefault(proposal.idea_id, {})[proposal.proposal_id] = None
+        self.closing.setdefault(proposal.end_time, []).append(
+            (proposal.idea_id, proposal.proposal_id)
+        )
+
+    def of(self, idea_id):
+        """Get the ids of the open proposals on an idea."""
+        return self.ideas.get(idea_id, {}).keys()
+
+    def due(self, t):
+        """Get the ids of the proposals that close at tick t."""
+        return [proposal_id for (_, proposal_id) in self.closing.get(t, [])]
+
+    def close(self, t):
+        """Drop the proposals that close at tick t."""
+        for (idea_id, proposal_id) in self.closing.pop(t, []):
+            del self.ideas[idea_id][proposal_id]
+
+            if len(self.ideas[idea_id]) == 0:
+                del self.ideas[idea_id]
@@ -3,8 +3,10 @@ from dataclasses import dataclass
 from random import randint, uniform, random, shuffle
 from actors.idea import Idea
 from actors.user import User
-from actors.voting_events import Voting_event
+from actors.event_log import Events
+from actors.balance_index import BalanceIndex
 import math
+import numpy as np
 
 
 @dataclass
@@ -46,19 +48,19 @@ class Proposal:
         return self.proposal_id == o.proposal_id
 
 
-def make_proposal(params, substep, state_history, prev_state, policy_input):
+def make_proposal(params, substep, state_history, prev_state):
     """User has a chance to make a proposal every 10 ticks on an idea."""
     if prev_state["timestep"] % 10 != 0:
-        return ("proposals", prev_state["proposals"])
+        return {"proposals": []}
 
     low_votes, high_votes = params["proposal_required_votes_range"]
     low_timout, high_timeout = params["proposal_timeout_range"]
     new_proposals = []
-    for user in prev_state["users"]:
-        idea: Idea
-        for idea in filter(
-            lambda idea: user.user_id in idea.shareholders, prev_state["ideas"]
-        ):
+    idea: Idea
+    for idea in prev_state["ideas"]:
+        # each shareholder of the idea has a chance to make one
+        (holders, _) = prev_state["ledger"].holders(idea.idea_id)
+        for _ in range(len(holders)):
             if random() > 0.1:
                 continue
 
@@ -71,167 +73,350 @@ def make_proposal(params, substep, state_history, prev_state, policy_input):
                 )
             )
 
-    return ("proposals", [*prev_state["proposals"], *new_proposals])
+    return {"proposals": new_proposals}
+
+
+def register_proposals(params, substep, state_history, prev_state, policy_input):
+    """Add the proposals made in the substep."""
+    for proposal in policy_input["proposals"]:
+        prev_state["proposals"][proposal.proposal_id] = proposal
+
+    return ("proposals", prev_state["proposals"])
+
+
+def open_proposals(params, substep, state_history, prev_state, policy_input):
+    """Open the proposals made in the substep to votes."""
+    for proposal in policy_input["proposals"]:
+        prev_state["open_proposals"].add(proposal)
+
+    return ("open_proposals", prev_state["open_proposals"])
 
 
 def vote_on_proposals(params, substep, state_history, prev_state):
     """User has a chance to vote on any proposal that they can vote on."""
     signal = {
         "proposal_votes": {},  # propsal_id -> votes
-        "user_frozen_tokens": {},  # user_id -> (proposal_id -> (idea_id, amount))
-        "user_lost_tokens": {},  # user_id -> (idea_id -> amount)
-        "voting_events": [],  # list of all the voting events that happened here
+        # user ids, proposal ids, idea ids, amounts
+        "frozen_tokens": ([], [], [], []),
+        # user ids, idea ids, amounts
+        "lost_tokens": ([], [], []),
+        "voting_events": Events(),  # all the voting events that happened here
     }
+
+    # Balances do not change while users vote, so enforcers can be picked from
+    # one index of them for the whole tick
+    users = BalanceIndex(prev_state["users"])
+
+    if params.get("batch_votes", True):
+        __batch_vote(prev_state, users, params, signal)
+
+        return signal
+
     user: User
     for user in prev_state["users"]:
-        signal["user_frozen_tokens"][user.user_id] = {}
-        signal["user_lost_tokens"][user.user_id] = {}
-
-        proposal: Proposal
-        for proposal in filter(lambda p: not p.is_passed, prev_state["proposals"]):
-            if (
-                random() > params["user_vote_chance"]
-                or proposal.idea_id not in user.tokens
-            ):
-                continue
+        # users can only vote on open proposals on ideas they hold tokens of
+        (idea_ids, amounts) = prev_state["ledger"].of(user.user_id)
+        for (idea_id, available_tokens) in zip(idea_ids.tolist(), amounts.tolist()):
+            for proposal_id in prev_state["open_proposals"].of(idea_id):
+                if random() > params["user_vote_chance"]:
+                    continue
+
+                __vote(
+                    prev_state["proposals"][proposal_id],
+                    user,
+                    available_tokens,
+                    users,
+                    params,
+                    signal,
+                )
 
-            available_tokens = user.tokens[proposal.idea_id]
+    return signal
 
-            used_tokens = available_tokens * uniform(
-                params["user_vote_tokens_precent_range"][0],
-                params["user_vote_tokens_precent_range"][1],
-            )
 
-            if used_tokens <= 0:
-                continue
+def __batch_vote(prev_state, users: BalanceIndex, params, signal):
+    """
+    Cast every vote of the tick at once, with arrays: who votes on which open
+    proposals, with how many tokens, and whether an enforcer claims the vote
+    was fraudulent. Only claims go to a jury, one by one.
+    """
+    (voters, proposal_ids, idea_ids, available) = ([], [], [], [])
+
+    # every holder of an idea can vote on each of its open proposals
+    for (idea_id, proposals) in prev_state["open_proposals"].ideas.items():
+        # users are listed by user_id
+        (holders, amounts) = prev_state["ledger"].holders(idea_id)
+
+        voters.append(np.repeat(holders, len(proposals)))
+        available.append(np.repeat(amounts, len(proposals)))
+        proposal_ids.append(np.tile(list(proposals), len(holders)))
+        idea_ids.append(np.full(len(holders) * len(proposals), idea_id))
+
+    if len(voters) == 0:
+        return
+
+    (voters, proposal_ids, idea_ids, available) = (
+        np.concatenate(voters),
+        np.concatenate(proposal_ids),
+        np.concatenate(idea_ids),
+        np.concatenate(available).astype(np.float64),
+    )
 
-            (votes, used_tokens, event) = __pass_vote(
-                proposal,
-                user,
-                used_tokens,
-                prev_state["users"],
-                params,
-            )
+    # who votes, and with how many of their tokens
+    votes = np.random.random(len(voters)) <= params["user_vote_chance"]
+    (low, high) = params["user_vote_tokens_precent_range"]
+    used = available[votes] * np.random.uniform(low, high, np.count_nonzero(votes))
+
+    votes = np.flatnonzero(votes)[used > 0]
+    used = used[used > 0]
+    (voters, proposal_ids, idea_ids) = (
+        voters[votes],
+        proposal_ids[votes],
+        idea_ids[votes],
+    )
 
-            signal["voting_events"].append(event)
+    # enforcers (any user but the voter who can match the tokens voted with)
+    # claim fraud based on their special information on the voter
+    guilty = np.random.random(len(voters)) < users.chance_to_lie[voters]
+    enforcers = users.pick_many(used, voters)
+    claims = np.flatnonzero(enforcers >= 0)
+    claims = claims[
+        np.random.random(len(claims))
+        < users.ranked_suspicion[enforcers[claims]]
+        + (2 * guilty[claims] - 1) * params["enforcer_information"]
+    ]
+
+    # votes nobody claims against go through
+    uncontested = np.ones(len(voters), dtype=np.bool_)
+    uncontested[claims] = False
+    signal["voting_events"].add_many(
+        users.ids[voters[uncontested]],
+        proposal_ids[uncontested],
+        guilty[uncontested],
+        used[uncontested],
+    )
 
-            if votes is None:
-                signal["user_lost_tokens"][user.user_id][proposal.idea_id] = (
-                    signal["user_lost_tokens"][user.user_id].get(proposal.idea_id, 0)
-                    + used_tokens
-                )
-            else:
-                signal["proposal_votes"][proposal.proposal_id] = (
-                    signal["proposal_votes"].get(proposal.proposal_id, 0) + votes
-                )
+    lost = np.zeros(len(voters), dtype=np.bool_)
+    for i in claims.tolist():
+        (cast, _) = __contest(
+            proposal_ids[i].item(),
+            users.users[voters[i]],
+            users.ranked[enforcers[i]],
+            used[i].item(),
+            guilty[i].item(),
+            users,
+            params,
+            signal["voting_events"],
+        )
+        lost[i] = cast is None
+
+    # votes are the square root of the tokens used, summed per proposal
+    (passed, tally) = np.unique(proposal_ids[~lost], return_inverse=True)
+    signal["proposal_votes"].update(
+        zip(
+            passed.tolist(),
+            np.bincount(tally, weights=np.sqrt(used[~lost])).tolist(),
+        )
+    )
 
-                signal["user_frozen_tokens"][user.user_id][proposal.proposal_id] = (
-                    proposal.idea_id,
-                    signal["user_frozen_tokens"][user.user_id].get(
-                        proposal.proposal_id, (0, 0)
-                    )[1]
-                    + used_tokens,
-                )
+    signal["frozen_tokens"] = (
+        users.ids[voters[~lost]],
+        proposal_ids[~lost],
+        idea_ids[~lost],
+        used[~lost],
+    )
+    signal["lost_tokens"] = (users.ids[voters[lost]], idea_ids[lost], used[lost])
+
+
+def __vote(
+    proposal: Proposal,
+    user: User,
+    available_tokens: float,
+    users: BalanceIndex,
+    params,
+    signal,
+):
+    """Have a user vote on a proposal with some of their tokens, if any."""
+    used_tokens = available_tokens * uniform(
+        params["user_vote_tokens_precent_range"][0],
+        params["user_vote_tokens_precent_range"][1],
+    )
 
-    return signal
+    if used_tokens <= 0:
+        return
+
+    (votes, used_tokens) = __pass_vote(
+        proposal,
+        user,
+        used_tokens,
+        users,
+        params,
+        signal["voting_events"],
+    )
 
+    if votes is None:
+        for (column, value) in zip(
+            signal["lost_tokens"], (user.user_id, proposal.idea_id, used_tokens)
+        ):
+            column.append(value)
+    else:
+        signal["proposal_votes"][proposal.proposal_id] = (
+            signal["proposal_votes"].get(proposal.proposal_id, 0) + votes
+        )
+
+        for (column, value) in zip(
+            signal["frozen_tokens"],
+            (user.user_id, proposal.proposal_id, proposal.idea_id, used_tokens),
+        ):
+            column.append(value)
 
-def __pass_vote(proposal: Proposal, voter: User, tokens: float, users: [User], params):
+
+def __pass_vote(
+    proposal: Proposal,
+    voter: User,
+    tokens: float,
+    users: BalanceIndex,
+    params,
+    events: Events,
+):
     """
     Use quadratic voting. With the enforcer-jury mechanism.
 
-    Returns the votes cast, tokens spent, and the voting event.
+    Returns the votes cast and tokens spent, and adds the voting event to events.
     If the votes are None, the user has been found guilty and should lose the tokens
     they voted with.
     """
-    event = Voting_event()
-
-    event.real_result_guilty = random() < voter.chance_to_lie
-
-    enforcer_list: [] = list(
-        filter(lambda u: u.user_id != voter.user_id and u.balance >= tokens, users)
-    )
+    real_result_guilty = random() < voter.chance_to_lie
 
-    shuffle(enforcer_list)
-
-    enforcer = None
-    if enforcer_list is not None and len(enforcer_list) > 0:
-        enforcer = enforcer_list[0]
+    # any user but the voter who can match the tokens voted with, at random
+    enforcer = users.pick(tokens, voter)
 
     enforcer_verdict = None
     if enforcer:
         enforcer_verdict = (
             random()
             < enforcer.suspicion
-            + (2 * event.real_result_guilty - 1) * params["enforcer_information"]
+            + (2 * real_result_guilty - 1) * params["enforcer_information"]
         )
 
     # start jury-enforcer mechanism if there is an enforcer
     # large amount of enforcer's claim is based on the voter's chance to lie since we
     # are assuming the enforcer has special information on the voter
     if enforcer and enforcer_verdict:
+        return __contest(
+            proposal.proposal_id,
+            voter,
+            enforcer,
+            tokens,
+            real_result_guilty,
+            users,
+            params,
+            events,
+        )
+
+    events.add(voter.user_id, proposal.proposal_id, real_result_guilty, tokens)
+
+    return (math.sqrt(tokens), tokens)
 
-        event.enforcer = enforcer
 
-        # random number of jurors (minus 1 for voter in users)
-        jury_size = math.ceil(random() * len(users)) - 1
+def __contest(
+    proposal_id,
+    voter: User,
+    enforcer: User,
+    tokens: float,
+    real_result_guilty: bool,
+    users: BalanceIndex,
+    params,
+    events: Events,
+):
+    """
+    Have a jury decide on an enforcer's claim that a vote was fraudulent.
 
-        # No jury, use enforcer's findings
-        if jury_size == 0:
-            event.jury_verdict_guilty = True
+    Returns the same as __pass_vote.
+    """
+    # random number of jurors (minus 1 for voter in users)
+    jury_size = math.ceil(random() * len(users)) - 1
+
+    # No jury, use enforcer's findings
+    if jury_size == 0:
+        events.add(
+            voter.user_id,
+            proposal_id,
+            real_result_guilty,
+            0,
+            enforcer.user_id,
+            jury_verdict_guilty=True,
+        )
 
-            return (None, tokens, event)
+        return (None, tokens)
 
-        jury = list(filter(lambda u: u != voter, users))[0 : jury_size - 1]
+    # the jurors themselves are only kept on the event if asked for
+    jurors = ()
+    if params.get("record_juries", True):
+        jury = users.first(jury_size - 1, voter)
 
         shuffle(jury)
 
-        event.jury = jury
-
-        # number of jurors that voted guilty
-        # jurors usually will have less information on the voter than the enforcer
-        voted_guilty = len(
-            list(
-                filter(
-                    lambda j: random()
-                    < j.suspicion
-                    + (2 * event.real_result_guilty - 1) * params["jury_information"],
-                    jury,
-                )
-            )
-        )
+        jurors = [juror.user_id for juror in jury]
 
-        # 2/3 supermajority required
-        if voted_guilty / jury_size >= 2 / 3:
-            event.jury_verdict_guilty = True
+    # number of jurors that voted guilty, drawn all at once
+    # jurors usually will have less information on the voter than the enforcer
+    voted_guilty = np.count_nonzero(
+        np.random.random(jury_size - 1)
+        < users.suspicions(jury_size - 1, voter)
+        + (2 * real_result_guilty - 1) * params["jury_information"]
+    )
 
-            return (None, tokens, event)
+    # 2/3 supermajority required
+    guilty = voted_guilty / jury_size >= 2 / 3
+
+    events.add(
+        voter.user_id,
+        proposal_id,
+        real_result_guilty,
+        0 if guilty else tokens,
+        enforcer.user_id,
+        jury_size - 1,
+        guilty,
+        jurors,
+    )
 
-    event.voter_tokens = tokens
+    if guilty:
+        return (None, tokens)
 
-    return (math.sqrt(tokens), tokens, event)
+    return (math.sqrt(tokens), tokens)
 
 
 def process_vote_input(params, substep, state_history, prev_state, policy_input):
     """Process proposal votes on the proposal's side."""
-    proposal: Proposal
-    for proposal in filter(
-        lambda p: p.proposal_id in policy_input["proposal_votes"],
-        prev_state["proposals"],
-    ):
-
-        proposal.current_votes += policy_input["proposal_votes"][proposal.proposal_id]
+    for (proposal_id, votes) in policy_input["proposal_votes"].items():
+        prev_state["proposals"][proposal_id].current_votes += votes
 
     return ("proposals", prev_state["proposals"])
 
 
-def update_proposal_status(params, substep, state_history, prev_state, policy_input):
-    """If the proposal time is up, either pass it or not."""
+def count_final_votes(params, substep, state_history, prev_state):
+    """
+    Close the proposals whose time is up: each either passes or not.
+    """
+    closed = {}  # proposal_id -> passed
     proposal: Proposal
-    for proposal in prev_state["proposals"]:
-        if prev_state["timestep"] != proposal.end_time:
-            continue
+    for proposal_id in prev_state["open_proposals"].due(prev_state["timestep"]):
+        proposal = prev_state["proposals"][proposal_id]
+        closed[proposal_id] = proposal.current_votes >= proposal.required_votes
+
+    return {"closed_proposals": closed}
 
-        proposal.is_passed = proposal.current_votes >= proposal.required_votes
+
+def update_proposal_status(params, substep, state_history, prev_state, policy_input):
+    """If the proposal time is up, either pass it or not."""
+    for (proposal_id, passed) in policy_input["closed_proposals"].items():
+        prev_state["proposals"][proposal_id].is_passed = passed
 
     return ("proposals", prev_state["proposals"])
+
+
+def close_proposals(params, substep, state_history, prev_state, policy_input):
+    """Stop taking votes on proposals whose time is up."""
+    prev_state["open_proposals"].close(prev_state["timestep"])
+
+    return ("open_proposals", prev_state["open_proposals"])
@@ -2,6 +2,7 @@
 from dataclasses import dataclass
 from random import random, uniform
 from numpy.random import normal
+import numpy as np
 
 
 @dataclass
@@ -9,7 +10,8 @@ class User:
     """
     Represents a user.
 
-    Can create proposals, vote on proposals, and buy tokens.
+    Can create proposals, vote on proposals, and buy tokens. The tokens they
+    hold, and have frozen in proposals, are kept in the TokenLedger.
     """
 
     # represents a balance of interchangable currency (not in idea tokens)
@@ -23,19 +25,11 @@ class User:
     # 0-100% chance to vote guilty/not guilty
     suspicion: float
 
-    # dict of idea_id -> amount
-    tokens: {}
-
-    # dict of proposal_id -> amount
-    frozen: {}
-
     def __init__(self, balance, user_id, chance_to_lie, suspicion):
         """Take the user's initial balance, and the user's ID."""
         self.balance = balance
         self.chance_to_lie = chance_to_lie
         self.suspicion = suspicion
-        self.tokens = {}
-        self.frozen = {}
         self.user_id = user_id
 
     def __hash__(self):
@@ -68,21 +62,25 @@ def generate_users(params, substep, state_history, prev_state, policy_input):
 
 
 def buy_token(params, substep, state_history, prev_state):
-    """See if any user would like to buy any tokens, then buy them."""
+    """
+    See if any user would like to buy any tokens, then buy them. Users buy in
+    order of user_id, so the ones first in line get an idea's tokens if its
+    treasury runs out.
+    """
+    if params.get("batch_buys", True):
+        return __batch_buy(prev_state, params)
+
     signal: dict = {
         "user_amount_spent": {},
-        "user_new_tokens": {},
-        "idea_treasury": {},
-        "idea_new_shareholders": {},
+        "token_buys": ([], [], []),  # user ids, idea ids, amounts
     }
+    (user_ids, idea_ids, amounts) = signal["token_buys"]
+    treasury = prev_state["ledger"].treasury.copy()
 
     for user in prev_state["users"]:
         # some chance to buy each token, taking a scaled random amount of their balance.
         amount_spent = 0
 
-        signal["user_new_tokens"][user.user_id] = {}
-        signal["user_amount_spent"][user.user_id] = 0
-
         for idea in prev_state["ideas"]:
 
             if random() > params["user_chance_to_buy_token"]:
@@ -93,28 +91,64 @@ def buy_token(params, substep, state_history, prev_state):
                 params["user_token_buy_precent_range"][1],
             ) * (user.balance - amount_spent)
 
-            if to_buy > idea.treasury:
-                to_buy = idea.treasury
+            if to_buy > treasury[idea.idea_id]:
+                to_buy = treasury[idea.idea_id].item()
 
             amount_spent += to_buy
+            treasury[idea.idea_id] -= to_buy
 
-            if idea.idea_id not in signal["idea_treasury"]:
-                signal["idea_treasury"][idea.idea_id] = idea.treasury
-
-            if idea.idea_id not in signal["idea_new_shareholders"]:
-                signal["idea_new_shareholders"][idea.idea_id] = set()
+            user_ids.append(user.user_id)
+            idea_ids.append(idea.idea_id)
+            amounts.append(to_buy)
 
-            signal["idea_treasury"][idea.idea_id] -= to_buy
+        signal["user_amount_spent"][user.user_id] = amount_spent
 
-            signal["idea_new_shareholders"][idea.idea_id].add(user.user_id)
+    return signal
 
-            signal["user_new_tokens"][user.user_id][idea.idea_id] = (
-                signal["user_new_tokens"][user.user_id].get(idea.idea_id, 0) + to_buy
-            )
 
-        signal["user_amount_spent"][user.user_id] = amount_spent
+def __batch_buy(prev_state, params):
+    """
+    Make every buy of the tick at once: whether each user buys each idea's
+    tokens, and with what share of the balance they have left, are drawn as
+    (ideas x users) matrices. Ideas are then sold one after another, each to
+    all of its buyers at once, with the cumulative sum of what they ask for
+    deciding who is still served when the treasury runs out.
 
-    return signal
+    Gets the same signal as buy_token.
+    """
+    # users are listed by user_id, and ideas by idea_id
+    users = prev_state["users"]
+    n_ideas = len(prev_state["ideas"])
+    treasury = prev_state["ledger"].treasury[:n_ideas]
+
+    # one row per idea, so that each idea's buyers are contiguous
+    buys = np.random.random((n_ideas, len(users))) <= params["user_chance_to_buy_token"]
+    (low, high) = params["user_token_buy_precent_range"]
+    shares = np.zeros(buys.shape)
+    shares[buys] = np.random.uniform(low, high, np.count_nonzero(buys))
+
+    balances = np.array([user.balance for user in users], dtype=np.float64)
+    left = balances.copy()
+    bought = np.zeros(buys.shape)
+
+    for idea_id in range(n_ideas):
+        wanted = shares[idea_id] * left
+
+        # what is left of the treasury once the users before each are served
+        bought[idea_id] = np.minimum(
+            wanted, np.maximum(treasury[idea_id] - (np.cumsum(wanted) - wanted), 0)
+        )
+        left -= bought[idea_id]
+
+    # in order of user, then idea
+    (user_ids, idea_ids) = np.nonzero(buys.T)
+
+    return {
+        "user_amount_spent": dict(
+            zip([user.user_id for user in users], (balances - left).tolist())
+        ),
+        "token_buys": (user_ids, idea_ids, bought[idea_ids, user_ids]),
+    }
 
 
 def pay_users(params, substep, state_history, prev_state, policy_input):
@@ -133,65 +167,9 @@ def pay_users(params, substep, state_history, prev_state, policy_input):
 
 
 def process_token_buy(params, substep, state_history, prev_state, policy_input):
-    """Process the token buy on the users' side."""
-    for user in filter(
-        lambda u: u.user_id in policy_input["user_amount_spent"], prev_state["users"]
-    ):
-        user.balance -= policy_input["user_amount_spent"][user.user_id]
-
-        new_tokens = policy_input["user_new_tokens"][user.user_id]
-        for token, add_amount in new_tokens.items():
-            user.tokens[token] = user.tokens.get(token, 0) + add_amount
-
-    return ("users", prev_state["users"])
-
-
-def process_vote_output(params, substep, state_history, prev_state, policy_input):
-    """Process the tokens used for proposal votes on the user's side."""
-    for user in filter(
-        lambda u: u.user_id in policy_input["user_frozen_tokens"], prev_state["users"]
-    ):
-        lost = policy_input["user_frozen_tokens"][user.user_id]
-        for proposal_id, (idea_id, remove_amount) in lost.items():
-            user.frozen[proposal_id] = (
-                idea_id,
-                user.frozen.get(proposal_id, (0, 0))[0] + remove_amount,
-            )
-
-            user.tokens[idea_id] -= remove_amount
-
-            # might be negative due to floating point rounding
-            if user.tokens[idea_id] < 0:
-                user.tokens[idea_id] = 0
-
-    for user in filter(
-        lambda u: u.user_id in policy_input["user_lost_tokens"], prev_state["users"]
-    ):
-        lost = policy_input["user_lost_tokens"][user.user_id]
-        for token, remove_amount in lost.items():
-            user.tokens[token] -= remove_amount
-
-            # might be negative due to floating point rounding
-            if user.tokens[token] < 0:
-                user.tokens[token] = 0
-
-    return ("users", prev_state["users"])
-
-
-def unfreeze_tokens(params, substep, state_history, prev_state, policy_input):
-    """Unfreeze tokens if a proposal is finished."""
-    user: User
-    for user in prev_state["users"]:
-        for proposal_id in user.frozen:
-
-            proposal = list(
-                filter(lambda p: p.proposal_id == proposal_id, prev_state["proposals"])
-            )[0]
-
-            if not proposal.is_passed:
-                continue
-
-            idea_id, amount = user.frozen[proposal_id]
-            user.tokens[idea_id] += amount
+    """Process the token buy on the users' side: pay for the tokens bought."""
+    for (user_id, amount_spent) in policy_input["user_amount_spent"].items():
+        # users are listed by user_id
+        prev_state["users"][user_id].balance -= amount_spent
 
     return ("users", prev_state["users"])
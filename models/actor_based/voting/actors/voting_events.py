@@ -1,6 +1,5 @@
 """Manages voting events."""
 from dataclasses import dataclass
-from actors.user import User
 
 
 @dataclass
@@ -8,14 +7,28 @@ class Voting_event:
     """
     Represents a voting event.
 
-    Catalogues the results of the enforcer-jury mechanism.
+    Catalogues the results of the enforcer-jury mechanism. Events are stored
+    in an EventLog, which gives them out as these.
     """
 
-    # true if enforcer claimed guilty
+    voting_event_id: int
+
+    # tick the vote was cast at
+    tick: int
+
+    voter_id: int
+    proposal_id: int
+
+    # the enforcer's user id if they claimed guilty
     # (and thus the voting event went through the enforcer-jury mechanism)
-    # if false, there was no valid enforcer or no enforcer contested
-    enforcer: User
-    jury: [User]
+    # if -1, there was no valid enforcer or no enforcer contested
+    enforcer_id: int
+
+    # number of jurors who ruled on the claim, and their user ids if they
+    # were recorded (see the record_juries param)
+    jury_size: int
+    jury: [int]
+
     jury_verdict_guilty: bool
     real_result_guilty: bool
 
@@ -23,16 +36,18 @@ class Voting_event:
     # the jury's verdict
     voter_tokens: float
 
-    voting_event_id: int
-
     def __init__(self):
         """Init with assumption of not guilty."""
-        self.enforcer = None
+        self.voting_event_id = -1
+        self.tick = -1
+        self.voter_id = -1
+        self.proposal_id = -1
+        self.enforcer_id = -1
+        self.jury_size = 0
         self.jury = []
         self.jury_verdict_guilty = False
         self.real_result_guilty = False
         self.voter_tokens = 0
-        self.voting_event_id = -1
 
     def __hash__(self):
         """voting_event_id is the hash."""
@@ -44,11 +59,9 @@ class Voting_event:
 
 
 def process_voting_events(params, substep, state_history, prev_state, policy_input):
-    """Create the voting events from votes made in the substep."""
-    new_events = []
-    event: Voting_event
-    for event in policy_input["voting_events"]:
-        event.voting_event_id = len(policy_input["voting_events"]) + len(new_events)
-        new_events.append(event)
-
-    return ("voting_events", [*prev_state["voting_events"], *new_events])
+    """Append the voting events from votes made in the substep to the log."""
+    prev_state["voting_events"].append(
+        policy_input["voting_events"], prev_state["timestep"]
+    )
+
+    return ("voting_events", prev_state["voting_events"])
@@ -1,28 +1,46 @@
 """Models the voting mechanisms of Vision."""
 from actors.idea import (
     generate_ideas,
-    process_token_sell,
+    add_ideas,
 )
 from actors.user import (
     generate_users,
     buy_token,
     process_token_buy,
-    process_vote_output,
     pay_users,
 )
 from actors.proposal import (
     make_proposal,
+    register_proposals,
+    open_proposals,
     vote_on_proposals,
     process_vote_input,
+    count_final_votes,
     update_proposal_status,
+    close_proposals,
 )
 from actors.voting_events import process_voting_events
+from actors.open_proposals import OpenProposals
+from actors.event_log import EventLog
+from actors.ledger import (
+    TokenLedger,
+    mint_tokens,
+    process_token_sell,
+    process_vote_output,
+    unfreeze_tokens,
+)
 
 initial_state = {
     "users": [],
     "ideas": [],
-    "proposals": [],
-    "voting_events": [],
+    # every idea token, in treasuries, held by users, or frozen in proposals
+    "ledger": TokenLedger(),
+    # proposal_id -> proposal
+    "proposals": {},
+    # proposals still open to votes, by idea and by when they close
+    "open_proposals": OpenProposals(),
+    # every voting event so far, append-only
+    "voting_events": EventLog(),
 }
 
 
@@ -43,9 +61,12 @@ state_update_blocks = [
     },
     # add 1 new idea every 45 ticks
     {
-        "policies": {},
+        "policies": {
+            "generate_ideas": generate_ideas,
+        },
         "variables": {
-            "ideas": generate_ideas,
+            "ideas": add_ideas,
+            "ledger": mint_tokens,
         },
     },
     {
@@ -54,13 +75,16 @@ state_update_blocks = [
         },
         "variables": {
             "users": process_token_buy,
-            "ideas": process_token_sell,
+            "ledger": process_token_sell,
         },
     },
     {
-        "policies": {},
+        "policies": {
+            "make_proposal": make_proposal,
+        },
         "variables": {
-            "proposals": make_proposal,
+            "proposals": register_proposals,
+            "open_proposals": open_proposals,
         },
     },
     {
@@ -69,14 +93,19 @@ state_update_blocks = [
         },
         "variables": {
             "voting_events": process_voting_events,
-            "users": process_vote_output,
+            "ledger": process_vote_output,
             "proposals": process_vote_input,
         },
     },
+    # close proposals whose time is up, giving frozen tokens back if they passed
     {
-        "policies": {},
+        "policies": {
+            "count_final_votes": count_final_votes,
+        },
         "variables": {
             "proposals": update_proposal_status,
+            "ledger": unfreeze_tokens,
+            "open_proposals": close_proposals,
         },
     },
 ]